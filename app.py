@@ -1,19 +1,89 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 import pandas as pd
 import os
-from data_processor import DataProcessor
-from io import BytesIO
+import logging
+import math
+import time
+from typing import Optional
+import metrics
+from cache import ResultCache, is_negative_result
+from data_processor import DEFAULT_PAGE_SIZE, MAX_DISTANCE_MILES, DataProcessor
+from http_cache import ResponseCache
+from metrics import span
+from profiler import RequestProfiler
+from search_index import DEFAULT_LIMIT, MAX_LIMIT, normalize_text
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 # Initialize data processor with the appropriate data directory for Vercel
-data_dir = 'static/data'
-if os.getenv('VERCEL_ENV') == 'production':
+data_dir = os.getenv('DATA_DIR', 'static/data')
+if os.getenv('VERCEL_ENV') == 'production' and not os.getenv('DATA_DIR'):
     # In Vercel production, use the absolute path
     data_dir = os.path.join(os.getcwd(), 'static', 'data')
 
 data_processor = DataProcessor(data_dir)
 
+# Encoded JSON for the autocomplete and stats endpoints; browsers revalidate
+# after RESPONSE_MAX_AGE seconds using the ETag
+response_cache = ResponseCache(
+    ResultCache(max_bytes=int(float(os.getenv('RESPONSE_CACHE_MB', '16')) * 1024 * 1024),
+                ttl=float(os.getenv('CACHE_TTL', '3600')),
+                negative_ttl=float(os.getenv('CACHE_NEGATIVE_TTL', '300'))),
+    max_age=int(os.getenv('RESPONSE_MAX_AGE', '300')),
+)
+# Responses of a replaced dataset can no longer be requested (keys carry the version)
+data_processor.reload_listeners.append(lambda dataset: response_cache.cache.clear())
+
+# Cache, plan and dataset metrics are read from their owners when /metrics is scraped
+metrics.REGISTRY.on_collect(data_processor.collect_metrics)
+metrics.REGISTRY.on_collect(lambda: metrics.collect_cache_stats('responses', response_cache.stats()))
+# Samples PROFILE_SAMPLE_RATE of requests; off by default
+profiler = RequestProfiler()
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    g.metrics_trace = metrics.start_trace()
+    g.profile = profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    seconds = time.perf_counter() - g.metrics_start
+    spans = metrics.end_trace(g.pop('metrics_trace'))
+    # The route pattern, not the path, keeps label values bounded
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    if not response.is_streamed and response.content_length is not None:
+        metrics.RESPONSE_BYTES.observe(response.content_length, endpoint=endpoint)
+    
+    description = f"{request.method} {request.full_path.rstrip('?')}"
+    if seconds >= profiler.slow_seconds:
+        metrics.SLOW_REQUESTS.inc(endpoint=endpoint)
+        logger.warning(f"Slow request {description} ({seconds * 1000:.0f}ms): "
+                       f"{metrics.format_spans(spans) or 'no spans recorded'}")
+    profiler.finish(g.pop('profile'), description, seconds)
+    return response
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    # Requests that failed before after_request still stop their sampler and trace
+    if g.get('profile') is not None:
+        g.pop('profile').stop()
+    if g.get('metrics_trace') is not None:
+        metrics.end_trace(g.pop('metrics_trace'))
+
+def _cached_json(key: str, compute):
+    """Respond with the pre-encoded JSON of compute(dataset) for a normalized query key.
+
+    The dataset is read once, so a reload during the request cannot pair one
+    version's ETag and cache key with another version's body.
+    """
+    dataset = data_processor.dataset
+    return response_cache.respond(request, dataset.version, key, lambda: compute(dataset),
+                                  negative=is_negative_result)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -23,87 +93,151 @@ def search():
     insurance_plans = data_processor.get_insurance_plans()
     return render_template('search.html', insurance_plans=insurance_plans)
 
+def _limit(args) -> int:
+    """Number of autocomplete suggestions, clamped to 1..MAX_LIMIT"""
+    return max(1, min(args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+
 @app.route('/api/procedures')
 def get_procedures():
     insurance_plan = request.args.get('plan', '')
     insurance_type = request.args.get('type', '')
     search_term = request.args.get('term', '')
-    procedures = data_processor.search_procedures(insurance_plan, insurance_type, search_term)
-    return jsonify(procedures)
+    limit = _limit(request.args)
+    key = f"procedures:{insurance_plan}:{normalize_text(search_term)}:{limit}"
+    return _cached_json(key, lambda dataset: data_processor.search_procedures(
+        insurance_plan, insurance_type, search_term, limit=limit, dataset=dataset))
+
+@app.route('/api/providers')
+def get_providers():
+    insurance_plan = request.args.get('plan', '')
+    search_term = request.args.get('term', '')
+    limit = _limit(request.args)
+    key = f"providers:{insurance_plan}:{normalize_text(search_term)}:{limit}"
+    return _cached_json(key, lambda dataset: data_processor.search_providers(
+        search_term, insurance_plan or None, limit=limit, dataset=dataset))
+
+def _distance(value) -> Optional[int]:
+    """Search radius in miles, capped at MAX_DISTANCE_MILES (ValueError if it is not a non-negative number)"""
+    if not value:
+        return None
+    distance = int(value)
+    if distance < 0:
+        raise ValueError(f"distance must not be negative: {value!r}")
+    return min(distance, MAX_DISTANCE_MILES)
+
+def _price(value) -> Optional[float]:
+    """Price bound in dollars (ValueError if it is not a finite number)"""
+    if not value:
+        return None
+    price = float(value)
+    if not math.isfinite(price):
+        raise ValueError(f"price must be a finite number: {value!r}")
+    return price
+
+def _search_params(args) -> dict:
+    """Parse the shared search/export query parameters into get_search_results arguments"""
+    return {
+        "insurance_plan": args.get('plan'),
+        "insurance_type": args.get('type', ''),
+        # A CPT/billing code can be given instead of the procedure name
+        "procedure": args.get('procedure') or args.get('code'),
+        "zipcode": args.get('zipcode'),
+        "sort_by": args.get('sort', 'price'),
+        "provider": args.get('provider'),
+        "min_price": _price(args.get('min_price')),
+        "max_price": _price(args.get('max_price')),
+        "distance": _distance(args.get('distance')),
+    }
+
+def _page_params(args) -> dict:
+    return {
+        "page": args.get('page', 1, type=int),
+        "page_size": args.get('page_size', DEFAULT_PAGE_SIZE, type=int),
+    }
 
 @app.route('/search_results')
 def search_results():
-    # Get all arguments from request
-    args = request.args.to_dict()
-    
-    # Set default sort if not provided
-    sort_by = args.get('sort', 'price')
+    try:
+        params = _search_params(request.args)
+    except ValueError as e:
+        return render_template('search_results.html', results={"error": f"Invalid filter: {e}", "results": []}), 400
     
-    # Convert numeric parameters
-    min_price = float(args.get('min_price')) if args.get('min_price') else None
-    max_price = float(args.get('max_price')) if args.get('max_price') else None
-    distance = int(args.get('distance')) if args.get('distance') else None
-    
-    if not all([args.get('plan'), args.get('procedure')]):
+    if not all([params['insurance_plan'], params['procedure']]):
         return render_template('search_results.html', 
                           results={"error": "Missing required parameters", "results": []})
     
-    results = data_processor.get_search_results(
-        insurance_plan=args.get('plan'),
-        insurance_type=args.get('type', ''),
-        procedure=args.get('procedure'),
-        zipcode=args.get('zipcode'),
-        sort_by=sort_by,
-        provider=args.get('provider'),
-        min_price=min_price,
-        max_price=max_price,
-        distance=distance
-    )
-    return render_template('search_results.html', results=results)
+    results = data_processor.get_search_results(**params, **_page_params(request.args))
+    metrics.RESULT_ROWS.observe(results.get('total', 0), endpoint='/search_results')
+    with span('render'):
+        return render_template('search_results.html', results=results)
+
+@app.route('/api/search_results')
+def api_search_results():
+    try:
+        params = _search_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}", "results": []}), 400
+    
+    if not all([params['insurance_plan'], params['procedure']]):
+        return jsonify({"error": "Missing required parameters", "results": []}), 400
+    
+    results = data_processor.get_search_results(**params, **_page_params(request.args))
+    metrics.RESULT_ROWS.observe(results.get('total', 0), endpoint='/api/search_results')
+    with span('jsonify'):
+        return jsonify(results)
+
+@app.route('/api/batch_quotes', methods=['POST'])
+def api_batch_quotes():
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "Request body must be a JSON object", "items": []}), 400
+    procedures = body.get('procedures') or body.get('codes')
+    if not isinstance(procedures, list) or not procedures:
+        return jsonify({"error": "A list of procedures or codes is required", "items": []}), 400
+    # Names are strings and codes may be numbers; anything else would be stringified into a query
+    if not all(isinstance(item, (str, int)) and not isinstance(item, bool) for item in procedures):
+        return jsonify({"error": "Procedures and codes must be strings or integers", "items": []}), 400
+    for field in ('plans', 'npis'):
+        if body.get(field) is not None and not isinstance(body[field], list):
+            return jsonify({"error": f"'{field}' must be a list", "items": []}), 400
+    
+    try:
+        quotes = data_processor.get_batch_quotes(
+            procedures,
+            plans=body.get('plans') or None,
+            npis=body.get('npis') or None,
+            zipcode=body.get('zipcode'),
+            distance=_distance(body.get('distance')),
+            rows=int(body.get('rows') or 0),
+        )
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": f"Invalid request: {e}", "items": []}), 400
+    metrics.RESULT_ROWS.observe(len(quotes["items"]), endpoint='/api/batch_quotes')
+    with span('jsonify'):
+        return jsonify(quotes), 200 if quotes["items"] else 400
 
 @app.route('/export_results')
 def export_results():
-    insurance_plan = request.args.get('plan')
-    insurance_type = request.args.get('type', '')
-    procedure = request.args.get('procedure')
-    zipcode = request.args.get('zipcode')
-    sort_by = request.args.get('sort', 'price')
-    provider = request.args.get('provider')
-    min_price = float(request.args.get('min_price')) if request.args.get('min_price') else None
-    max_price = float(request.args.get('max_price')) if request.args.get('max_price') else None
-    distance = int(request.args.get('distance')) if request.args.get('distance') else None
-
-    if not all([insurance_plan, procedure]):
-        return "Missing required parameters", 400
+    try:
+        params = _search_params(request.args)
+    except ValueError as e:
+        return f"Invalid filter: {e}", 400
+    procedure = params['procedure']
 
-    results = data_processor.get_search_results(
-        insurance_plan=insurance_plan,
-        insurance_type=insurance_type,
-        procedure=procedure,
-        zipcode=zipcode,
-        sort_by=sort_by,
-        provider=provider,
-        min_price=min_price,
-        max_price=max_price,
-        distance=distance
-    )
+    if not all([params['insurance_plan'], procedure]):
+        return "Missing required parameters", 400
 
-    csv_data = data_processor.export_search_results(results)
-    if not csv_data:
+    params.pop('insurance_type')
+    chunks = data_processor.export_search_results(**params)
+    if chunks is None:
         return "No data to export", 404
 
-    # Convert string data to bytes
-    csv_bytes = csv_data.encode('utf-8')
-    
-    # Create BytesIO object
-    mem_file = BytesIO(csv_bytes)
-    
-    filename = f"healthcare_prices_{procedure.replace(' ', '_')}.csv"
-    return send_file(
-        mem_file,
+    safe_name = procedure.replace(' ', '_').replace('"', '')
+    filename = f"healthcare_prices_{safe_name}.csv"
+    return Response(
+        stream_with_context(chunks),
         mimetype='text/csv',
-        as_attachment=True,
-        download_name=filename
+        headers={"Content-Disposition": f"attachment; filename=\"{filename}\""}
     )
 
 @app.route('/stats')
@@ -115,8 +249,23 @@ def get_stats_data():
     procedure = request.args.get('procedure')
     if not procedure:
         return jsonify({"error": "Procedure parameter is required"})
-    stats_data = data_processor.get_stats_data(procedure)
-    return jsonify(stats_data)
+    try:
+        params = _search_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+    filters = {name: params[name] for name in ('zipcode', 'provider', 'min_price', 'max_price', 'distance')}
+    key = f"stats_data:{procedure}:" + ':'.join(str(value) for value in filters.values())
+    return _cached_json(key, lambda dataset: data_processor.get_stats_data(procedure, **filters, dataset=dataset))
+
+@app.route('/api/cache_stats')
+def get_cache_stats():
+    stats = data_processor.get_cache_stats()
+    stats['responses'] = response_cache.stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/stats_results')
 def stats_results():
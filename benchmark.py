@@ -0,0 +1,243 @@
+"""Benchmark loading and the main endpoints on synthetic data.
+
+Usage:
+    python benchmark.py [--rows 100000] [--plans 3] [--procedures 1000] [--zipf 1.1]
+                        [--data-dir DIR] [--columnar] [--lazy] [--requests 200]
+                        [--scenarios cold_start,cache_miss,cache_hit] [--output results.json]
+
+Data is generated with synthetic_data.py into a temporary directory unless
+--data-dir points at existing plan files. The app is imported against that
+directory (the cold start), then each endpoint is driven through the Flask
+test client with every cache cleared before each request (cache_miss) and
+with a repeated, warmed request (cache_hit). The report is one JSON
+document with latency percentiles, throughput, peak RSS and the run
+parameters, so runs on different commits can be diffed.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+SCENARIOS = ['cold_start', 'cache_miss', 'cache_hit']
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def summarize_latencies(name: str, scenario: str, latencies: List[float], elapsed: float, errors: int) -> Dict:
+    """Latency percentiles (ms) and throughput for one endpoint and scenario"""
+    values = np.array(latencies) * 1000
+    return {
+        'endpoint': name,
+        'scenario': scenario,
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p90_ms': round(float(np.percentile(values, 90)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'mean_ms': round(float(values.mean()), 3),
+        'max_ms': round(float(values.max()), 3),
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None,
+    }
+
+
+class Workload:
+    """Request URLs drawn from the loaded plans, with procedures picked by popularity"""
+
+    def __init__(self, data_processor, requests: int, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        dataset = data_processor.dataset
+        self.plans = [name[len('Austin_'):-len('_data.csv')] for name in sorted(dataset.data_sources)]
+        self.procedures = {}
+        for plan in self.plans:
+            plan_index = dataset.get_plan_index(f"Austin_{plan}_data.csv")
+            sizes = plan_index.procedure_rows()
+            names = sizes.index.to_numpy()
+            weights = sizes.to_numpy(dtype='float64')
+            # Popular procedures are requested more often, like the rows they own
+            self.procedures[plan] = list(rng.choice(names, size=requests, p=weights / weights.sum()))
+        zips = [zipcode for zipcode in data_processor.zip_centroids.table.index if zipcode.startswith('787')]
+        self.zips = list(rng.choice(zips or ['78701'], size=requests))
+        self.rng = rng
+        self.requests = requests
+
+    def _plan(self, i: int) -> str:
+        return self.plans[i % len(self.plans)]
+
+    def endpoints(self) -> Dict[str, Callable[[int], Dict]]:
+        """Endpoint name -> function building the i-th request as test client kwargs"""
+        def procedures(i):
+            plan = self._plan(i)
+            name = self.procedures[plan][i]
+            return {'path': '/api/procedures', 'query_string': {'plan': plan, 'term': name[:4 + i % 4]}}
+
+        def search(i):
+            plan = self._plan(i)
+            query = {'plan': plan, 'procedure': self.procedures[plan][i]}
+            if i % 2:
+                query.update(zipcode=self.zips[i], sort='proximity', distance=25)
+            return {'path': '/api/search_results', 'query_string': query}
+
+        def stats(i):
+            plan = self._plan(i)
+            return {'path': '/api/stats_data', 'query_string': {'procedure': self.procedures[plan][i]}}
+
+        def export(i):
+            plan = self._plan(i)
+            return {'path': '/export_results', 'query_string': {'plan': plan, 'procedure': self.procedures[plan][i]}}
+
+        def batch(i):
+            plan = self._plan(i)
+            picks = [self.procedures[plan][(i + k) % self.requests] for k in range(20)]
+            return {'path': '/api/batch_quotes', 'method': 'POST', 'json': {'procedures': picks, 'rows': 3}}
+
+        return {'search_procedures': procedures, 'get_search_results': search, 'get_stats_data': stats,
+                'export_search_results': export, 'batch_quotes': batch}
+
+
+def issue(client, request: Dict):
+    """Send one request and read the whole (possibly streamed) body"""
+    request = dict(request)
+    method = request.pop('method', 'GET')
+    response = client.open(method=method, **request)
+    _ = response.get_data()
+    return response.status_code
+
+
+def run_endpoint(app_module, client, name: str, build: Callable[[int], Dict], requests: int,
+                 scenario: str) -> Dict:
+    """Drive one endpoint for one scenario and summarize its latencies"""
+    latencies, errors = [], 0
+    if scenario == 'cache_hit':
+        issue(client, build(0))
+    started = time.perf_counter()
+    for i in range(requests):
+        request = build(0 if scenario == 'cache_hit' else i)
+        if scenario == 'cache_miss':
+            app_module.data_processor.cache.clear()
+            app_module.response_cache.cache.clear()
+        t0 = time.perf_counter()
+        status = issue(client, request)
+        latencies.append(time.perf_counter() - t0)
+        errors += status >= 400
+    return summarize_latencies(name, scenario, latencies, time.perf_counter() - started, errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading and endpoints on synthetic plan data")
+    parser.add_argument('--data-dir', help="Existing plan files to use instead of generating data")
+    parser.add_argument('--rows', type=int, default=100_000, help="Total rows to generate across all plans")
+    parser.add_argument('--plans', type=int, default=3)
+    parser.add_argument('--procedures', type=int, default=1000)
+    parser.add_argument('--providers', type=int, default=2000)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--columnar', action='store_true', help="Convert the data to Arrow with ingest.py first")
+    parser.add_argument('--lazy', action='store_true', help="Benchmark with LAZY_LOAD=true")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and scenario")
+    parser.add_argument('--endpoints', help="Comma-separated subset of endpoints")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+
+    import logging
+    logging.disable(logging.INFO)
+
+    tmp = None
+    data_dir = args.data_dir
+    generate_seconds = None
+    if data_dir is None:
+        tmp = tempfile.TemporaryDirectory(prefix='healthcare-bench-')
+        data_dir = tmp.name
+        t0 = time.perf_counter()
+        # In a child process, so generation does not count towards this process's peak RSS
+        subprocess.run([
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthetic_data.py'), data_dir,
+            '--rows', str(args.rows), '--plans', str(args.plans), '--procedures', str(args.procedures),
+            '--providers', str(args.providers), '--zipf', str(args.zipf), '--seed', str(args.seed),
+        ], check=True, stderr=subprocess.DEVNULL)
+        generate_seconds = round(time.perf_counter() - t0, 3)
+    if args.columnar:
+        from ingest import convert_data_dir
+        convert_data_dir(data_dir)
+
+    os.environ['DATA_DIR'] = data_dir
+    os.environ['LAZY_LOAD'] = 'true' if args.lazy else 'false'
+    os.environ.setdefault('USE_REDIS', 'false')
+    importlib.import_module('flask')
+    rss_before = peak_rss_mb()
+    t0 = time.perf_counter()
+    app_module = importlib.import_module('app')
+    cold_start = time.perf_counter() - t0
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'params': {key: value for key, value in vars(args).items() if key != 'output'},
+            'data_dir': None if tmp else data_dir,
+            'data_bytes': sum(entry.stat().st_size for entry in os.scandir(data_dir) if entry.is_file()),
+            'generate_seconds': generate_seconds,
+        },
+        'results': [],
+    }
+    if 'cold_start' in scenarios:
+        report['cold_start'] = {
+            'seconds': round(cold_start, 3),
+            'rss_before_mb': rss_before,
+            'peak_rss_mb': peak_rss_mb(),
+            'plans': len(app_module.data_processor.dataset.data_sources),
+            'rows': sum(len(plan_index) for plan_index in app_module.data_processor.dataset.plan_indexes.values()),
+        }
+
+    client = app_module.app.test_client()
+    endpoints = Workload(app_module.data_processor, args.requests, seed=args.seed).endpoints()
+    if args.endpoints:
+        selected = {name.strip() for name in args.endpoints.split(',')}
+        endpoints = {name: build for name, build in endpoints.items() if name in selected}
+    for scenario in scenarios:
+        if scenario == 'cold_start':
+            continue
+        for name, build in endpoints.items():
+            report['results'].append(run_endpoint(app_module, client, name, build, args.requests, scenario))
+    report['peak_rss_mb'] = peak_rss_mb()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+import logging
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+try:
+    import msgpack
+    import redis
+except ImportError:  # pragma: no cover - exercised only without the Redis extras installed
+    msgpack = None
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Returned by ResultCache.get when a key is absent, so falsy values ([] or {}) are real hits
+MISSING = object()
+
+
+def estimate_size(value) -> int:
+    """Approximate bytes a cached value occupies"""
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def is_negative_result(value) -> bool:
+    """Empty lists and error payloads are cached for the shorter negative TTL"""
+    if isinstance(value, dict):
+        return bool(value.get("error"))
+    return not value
+
+
+class _Flight:
+    """A computation in progress that concurrent callers for the same key wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = MISSING
+
+
+class ResultCache:
+    """Thread-safe LRU cache with a byte budget, TTLs and per-key single-flight.
+
+    - Entries are evicted least recently used first once their estimated
+      total size exceeds max_bytes; a single value larger than the budget is
+      not cached at all.
+    - Negative results (as judged by the caller's `negative` predicate) are
+      kept for the shorter negative_ttl so unknown terms do not recompute on
+      every request, yet recover quickly once data changes.
+    - When several threads miss the same key, one computes and the others
+      wait for its result instead of repeating the work.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600, negative_ttl: float = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ['hits', 'misses', 'negative_hits', 'sets', 'evictions', 'expirations', 'rejections', 'coalesced'], 0
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, count=False) is not MISSING
+
+    def _lookup(self, key: str, count: bool = True):
+        """Return the cached value or MISSING; the caller holds the lock"""
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self._counters['misses'] += 1
+            return MISSING
+        value, size, expires_at, negative = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self._counters['expirations'] += 1
+            if count:
+                self._counters['misses'] += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        if count:
+            self._counters['hits'] += 1
+            if negative:
+                self._counters['negative_hits'] += 1
+        return value
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[1]
+
+    def get(self, key: str, count: bool = True):
+        """Return the cached value for key, or MISSING"""
+        with self._lock:
+            return self._lookup(key, count)
+
+    def set(self, key: str, value, ttl: Optional[float] = None, negative: bool = False):
+        """Store a value, evicting least recently used entries to stay within the byte budget"""
+        size = estimate_size(value)
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                self._counters['rejections'] += 1
+                return
+            while self._entries and self._bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+            self._entries[key] = (value, size, time.monotonic() + ttl, negative)
+            self._bytes += size
+            self._counters['sets'] += 1
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any],
+                       negative: Optional[Callable[[Any], bool]] = None):
+        """Return the cached value for key, computing and caching it on a miss.
+
+        Concurrent misses for the same key share one call to compute.
+        Exceptions propagate to every waiting caller's own retry and are
+        never cached.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not MISSING:
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.value is not MISSING:
+                return flight.value
+            # The leader failed; compute independently so the error surfaces here too
+            return compute()
+
+        try:
+            value = compute()
+            self.set(key, value, negative=bool(negative and negative(value)))
+            flight.value = value
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus current size, readable at runtime"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def _encode_default(value):
+    """msgpack fallback for numpy scalars and arrays"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot encode {type(value).__name__} for the shared cache")
+
+
+def encode_value(value) -> bytes:
+    return msgpack.packb(value, default=_encode_default, use_bin_type=True)
+
+
+def decode_value(payload: bytes):
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+class CircuitBreaker:
+    """Skips calls to a failing dependency for reset_timeout seconds after `threshold` consecutive failures.
+
+    Once the timeout passes a single probe call is let through; its success
+    closes the circuit and its failure re-opens it.
+    """
+
+    def __init__(self, threshold: int = 3, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        return 'half-open' if self._probing else 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Shared cache recovered; circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Shared cache failed {self._failures} times; bypassing it for {self.reset_timeout:g}s")
+                self._opened_at = time.monotonic()
+
+
+class RedisCache:
+    """Shared second cache tier in Redis.
+
+    Values are msgpack-encoded and keys are prefixed with a namespace and the
+    dataset version, so a reload with new data never serves stale entries
+    (old keys simply expire). Every call is bounded by the client's socket
+    timeout and guarded by a circuit breaker, so a slow or unreachable Redis
+    degrades to the in-memory tier instead of delaying requests.
+    """
+
+    def __init__(self, client, namespace: str = 'healthcare', version: str = '', ttl: float = 3600,
+                 negative_ttl: float = 300, breaker: Optional[CircuitBreaker] = None):
+        if msgpack is None:
+            raise ImportError("msgpack is required for the Redis cache")
+        self.client = client
+        self.namespace = namespace
+        self.version = version
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.breaker = breaker or CircuitBreaker()
+        self._last_version = version
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(['hits', 'misses', 'sets', 'errors', 'skipped'], 0)
+
+    @classmethod
+    def from_url(cls, url: str, timeout: float = 0.25, max_connections: int = 20, **kwargs) -> 'RedisCache':
+        """Connect through a bounded connection pool with short socket timeouts"""
+        if redis is None:
+            raise ImportError("redis is required for the Redis cache")
+        pool = redis.ConnectionPool.from_url(
+            url, max_connections=max_connections, socket_timeout=timeout, socket_connect_timeout=timeout,
+        )
+        return cls(redis.Redis(connection_pool=pool), **kwargs)
+
+    def _key(self, key: str, version: Optional[str] = None) -> str:
+        if version is None:
+            version = self.version
+        # Callers pass the dataset version per call; remembered so stats() shows the one in use
+        self._last_version = version
+        return f"{self.namespace}:{version}:{key}"
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key: str, version: Optional[str] = None):
+        """Return the shared value for key (in a dataset version), or MISSING (also when Redis is unavailable)"""
+        if not self.breaker.allow():
+            self._count('skipped')
+            return MISSING
+        try:
+            payload = self.client.get(self._key(key, version))
+        except Exception as e:
+            self.breaker.record_failure()
+            self._count('errors')
+            logger.warning(f"Redis get failed: {e}")
+            return MISSING
+        self.breaker.record_success()
+        if payload is None:
+            self._count('misses')
+            return MISSING
+        try:
+            value = decode_value(payload)
+        except Exception as e:
+            self._count('errors')
+            logger.warning(f"Discarding undecodable cache entry {key}: {e}")
+            return MISSING
+        self._count('hits')
+        return value
+
+    def set(self, key: str, value, negative: bool = False, version: Optional[str] = None):
+        """Store a value for the (negative) TTL; failures are logged and ignored"""
+        # Encoded before asking the breaker, so an unencodable value never takes (and strands) the half-open probe
+        try:
+            payload = encode_value(value)
+        except TypeError as e:
+            self._count('errors')
+            logger.warning(f"Not sharing cache entry {key}: {e}")
+            return
+        if not self.breaker.allow():
+            self._count('skipped')
+            return
+        ttl = self.negative_ttl if negative else self.ttl
+        try:
+            self.client.set(self._key(key, version), payload, ex=max(1, int(ttl)))
+        except Exception as e:
+            self.breaker.record_failure()
+            self._count('errors')
+            logger.warning(f"Redis set failed: {e}")
+            return
+        self.breaker.record_success()
+        self._count('sets')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(state=self.breaker.state, version=self._last_version)
+        return stats
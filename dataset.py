@@ -0,0 +1,275 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from dimensions import ProcedureDimension, ProviderDimension
+from geo import ZipCentroids
+from ingest import (
+    COLUMNAR_EXTENSION, CSV_EXTENSIONS, content_hash, file_digest, read_columnar, read_csv_typed, read_manifest,
+    read_procedure_pairs,
+)
+from metrics import PLAN_LOAD_SECONDS
+from plan_index import PlanIndex, normalize_billing_code
+from search_index import ProcedureSearchIndex
+from stats_index import StatsIndex
+
+logger = logging.getLogger(__name__)
+
+
+def parse_insurance_info(filename: str) -> Optional[Dict[str, str]]:
+    """Parse insurance and type from filename"""
+    data_match = re.match(r"Austin_(.+?)_data\.csv", filename)
+    summary_match = re.match(r"summary_Austin_(.+?)\.csv", filename)
+
+    if data_match:
+        return {"insurance": data_match.group(1), "type": "", "is_summary": False}
+    elif summary_match:
+        return {"insurance": summary_match.group(1), "type": "", "is_summary": True}
+    return None
+
+
+def data_filename(insurance_plan: str) -> str:
+    """Logical data filename of a plan"""
+    return f"Austin_{insurance_plan}_data.csv"
+
+
+# path -> (size, mtime_ns, digest), so unchanged files are not read again on every reload check
+_digests: Dict[str, Tuple[int, int, str]] = {}
+_digests_lock = threading.Lock()
+
+
+def _cached_digest(path: str) -> str:
+    """Content digest of a file, recomputed only when its size or mtime changes"""
+    stat = os.stat(path)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    digest = file_digest(path)
+    with _digests_lock:
+        _digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def fingerprint(sources: Dict[str, str]) -> str:
+    """Version of a set of files from their content.
+
+    Identical data gets the same version on every host and checkout, which
+    keeps version-prefixed keys in the shared Redis tier valid across
+    instances. A version directory written by `ingest.py --raw` carries its
+    content hash in manifest.json; other files are hashed by name, size and
+    content digest.
+    """
+    directories = {os.path.dirname(file_path) for file_path in sources.values()}
+    if len(directories) == 1:
+        manifest = read_manifest(directories.pop())
+        if manifest and manifest.get('content_hash'):
+            return manifest['content_hash'][:12]
+    return content_hash(sources, digest_of=_cached_digest)[:12]
+
+
+def read_file(file_path: str) -> pd.DataFrame:
+    """Read a plan or summary file, memory-mapping columnar files"""
+    if file_path.endswith(COLUMNAR_EXTENSION):
+        try:
+            return read_columnar(file_path)
+        except Exception as e:
+            logger.warning(f"Could not read columnar file {file_path}, falling back to CSV: {e}")
+            stem = file_path[:-len(COLUMNAR_EXTENSION)]
+            for extension in CSV_EXTENSIONS:
+                if os.path.exists(stem + extension):
+                    return read_csv_typed(stem + extension)
+            raise
+    return read_csv_typed(file_path)
+
+
+class Dataset:
+    """Everything loaded from one version of the data files.
+
+    Plans, summaries, the shared dimensions and every index built from them
+    belong to a single Dataset. DataProcessor replaces the whole object on
+    reload, so a request that took a reference to it keeps a consistent view
+    until it finishes, however long a reload takes.
+    """
+
+    def __init__(self, sources: Dict[str, str], zip_centroids: ZipCentroids,
+                 lazy_load: bool = False, memory_budget: int = 0):
+        self.sources = sources
+        self.version = fingerprint(sources)
+        self.lazy_load = lazy_load
+        self.memory_budget = memory_budget
+
+        self.data_sources = {}
+        self.plan_indexes = OrderedDict()
+        self.summary_files = {}
+        self.all_procedures_search = None
+        self.stats_index = StatsIndex([])
+        self._load_lock = threading.RLock()
+        # Guards the LRU order of plan_indexes, which requests update without waiting for a load
+        self._lru_lock = threading.Lock()
+        # Provider and procedure details shared by every plan's fact table
+        self.providers = ProviderDimension(zip_centroids)
+        self.procedures = ProcedureDimension()
+
+    def load(self):
+        """Load summaries and, unless lazy loading is on, every plan.
+
+        Files are preferred in memory-mapped columnar form over CSV. In lazy mode
+        only file metadata is read here; plans load on first request.
+        """
+        for filename, file_path in sorted(self.sources.items()):
+            file_info = parse_insurance_info(filename)
+
+            if not file_info:
+                logger.warning(f"Skipping file with invalid naming pattern: {filename}")
+                continue
+
+            if not file_info["is_summary"]:
+                self.data_sources[filename] = file_path
+                continue
+
+            try:
+                self.summary_files[filename] = read_file(file_path)
+                logger.info(f"Loaded summary file: {filename}")
+            except Exception as e:
+                logger.error(f"Error reading {file_path}: {str(e)}")
+
+        self.stats_index = StatsIndex([
+            (parse_insurance_info(filename)['insurance'], df) for filename, df in sorted(self.summary_files.items())
+        ])
+
+        if not self.lazy_load:
+            for filename in sorted(self.data_sources):
+                self._load_plan(filename)
+            self._build_all_procedures_index()
+
+        logger.info(
+            f"Dataset {self.version}: {len(self.data_sources)} data files ({len(self.plan_indexes)} loaded) "
+            f"and {len(self.summary_files)} summary files"
+        )
+        return self
+
+    def _load_plan(self, filename: str) -> Optional[PlanIndex]:
+        """Read and index one plan's data file, then enforce the memory budget"""
+        file_path = self.data_sources[filename]
+        start = time.perf_counter()
+        try:
+            plan_index = PlanIndex(read_file(file_path), self.providers, self.procedures)
+        except Exception as e:
+            logger.error(f"Error reading {file_path}: {str(e)}")
+            return None
+        seconds = time.perf_counter() - start
+        PLAN_LOAD_SECONDS.observe(seconds, plan=parse_insurance_info(filename)['insurance'])
+
+        plan_memory = plan_index.memory_usage()
+        with self._lru_lock:
+            self.plan_indexes[filename] = plan_index
+        logger.info(
+            f"Loaded data file: {filename} in {seconds:.2f}s ({len(plan_index.procedure_names)} procedures indexed, "
+            f"{plan_memory / 1e6:.1f} MB, {len(self.providers)} providers shared)"
+        )
+        self._evict_plans(keep=filename)
+        return plan_index
+
+    def shared_memory_usage(self) -> int:
+        """Approximate bytes held by the provider and procedure dimensions every plan references"""
+        return self.providers.memory_usage() + self.procedures.memory_usage()
+
+    def loaded_plans(self) -> List[Tuple[str, PlanIndex]]:
+        """Snapshot of the loaded plans, least recently used first"""
+        with self._lru_lock:
+            return list(self.plan_indexes.items())
+
+    def _evict_plans(self, keep: str):
+        """Drop least recently used plans until they and the shared dimensions fit the memory budget.
+
+        The dimensions count against the budget but are never shrunk here (every
+        loaded plan references their ids), so they only leave less room for plans.
+        """
+        if not self.memory_budget:
+            return
+        shared = self.shared_memory_usage()
+        with self._lru_lock:
+            total = shared + sum(plan_index.memory_usage() for plan_index in self.plan_indexes.values())
+            evicted = []
+            for filename in list(self.plan_indexes):
+                if total <= self.memory_budget:
+                    break
+                if filename == keep:
+                    continue
+                total -= self.plan_indexes.pop(filename).memory_usage()
+                evicted.append(filename)
+        for filename in evicted:
+            logger.info(
+                f"Evicted data file: {filename} (memory budget {self.memory_budget / 1e6:.0f} MB, "
+                f"{shared / 1e6:.1f} MB of it held by the shared provider and procedure dimensions)"
+            )
+        if total > self.memory_budget:
+            logger.warning(
+                f"Loaded data ({total / 1e6:.1f} MB, {shared / 1e6:.1f} MB shared dimensions) exceeds the memory "
+                f"budget of {self.memory_budget / 1e6:.0f} MB with only {keep} loaded"
+            )
+
+    def get_plan_index(self, filename: str) -> Optional[PlanIndex]:
+        """Return a plan's index, loading it on first use"""
+        plan_index = self.plan_indexes.get(filename)
+        if plan_index is None:
+            if filename not in self.data_sources:
+                return None
+            with self._load_lock:
+                plan_index = self.plan_indexes.get(filename)
+                if plan_index is None:
+                    return self._load_plan(filename)
+        with self._lru_lock:
+            # Skipped if a concurrent load evicted it; the caller still holds a usable index
+            if filename in self.plan_indexes:
+                self.plan_indexes.move_to_end(filename)
+        return plan_index
+
+    def get_all_procedures_search(self) -> ProcedureSearchIndex:
+        """Return the merged autocomplete index, building it on first use in lazy mode"""
+        if self.all_procedures_search is None:
+            with self._load_lock:
+                if self.all_procedures_search is None:
+                    self._build_all_procedures_index()
+        return self.all_procedures_search
+
+    def _build_all_procedures_index(self):
+        """Build the merged autocomplete index of distinct procedures across every plan.
+
+        Only the procedure columns are read for plans that are not loaded, so this
+        does not pull whole plans into memory.
+        """
+        coverage = {}
+        sources = [(filename, self.summary_files[filename]) for filename in self.summary_files]
+        sources += [(filename, None) for filename in self.data_sources]
+
+        for filename, df in sources:
+            file_info = parse_insurance_info(filename)
+            if not file_info:
+                continue
+            try:
+                if df is None and filename in self.plan_indexes:
+                    pairs = self.plan_indexes[filename].procedure_pairs()
+                elif df is None:
+                    pairs = read_procedure_pairs(self.data_sources[filename])
+                else:
+                    pairs = df[['procedure_name', 'billing_code']].dropna(subset=['procedure_name']).drop_duplicates()
+            except Exception as e:
+                logger.error(f"Error reading procedures from {filename}: {str(e)}")
+                continue
+            for name, code in zip(pairs['procedure_name'], pairs['billing_code'].map(normalize_billing_code)):
+                coverage.setdefault((name, code), set()).add(file_info['insurance'])
+
+        entries = [
+            {"procedure_name": name, "billing_code": code, "plans": sorted(plans)}
+            for (name, code), plans in sorted(coverage.items())
+        ]
+        self.all_procedures_search = ProcedureSearchIndex(entries)
+        logger.info(f"Indexed {len(entries)} distinct procedures across all plans")
@@ -0,0 +1,252 @@
+import logging
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from geo import ZipCentroids
+from search_index import DEFAULT_LIMIT, ProcedureSearchIndex, ProviderSearchIndex, under_prefix, with_prefix
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_COLUMNS = [
+    'Provider Organization Name (Legal Business Name)',
+    'Provider Other Organization Name',
+    'Provider First Line Business Practice Location Address',
+    'Provider Second Line Business Practice Location Address',
+    'Provider Business Practice Location Address City Name',
+    'Provider Business Practice Location Address State Name',
+    'Provider Business Practice Location Address Postal Code',
+    'Provider Business Practice Location Address Telephone Number',
+]
+
+# Low-cardinality provider columns stored as categoricals
+CATEGORICAL_PROVIDER_COLUMNS = [
+    'Provider Business Practice Location Address City Name',
+    'Provider Business Practice Location Address State Name',
+]
+
+POSTAL_CODE_COLUMN = 'Provider Business Practice Location Address Postal Code'
+LEGAL_NAME_COLUMN = 'Provider Organization Name (Legal Business Name)'
+OTHER_NAME_COLUMN = 'Provider Other Organization Name'
+
+
+def _text(values: pd.Series) -> pd.Series:
+    """Values as strings with missing values kept missing (before pandas 3, astype('str') writes 'nan'/'None')"""
+    return values.astype('str').where(values.notna(), None)
+
+
+def provider_keys(df: pd.DataFrame) -> np.ndarray:
+    """Provider key per row as int64, reading 'npi' or its duplicate 'NPI' column.
+
+    The key is the NPI when there is one. Rows without an NPI get a negative
+    key hashed from the provider's name and address, so distinct providers
+    without NPIs stay distinct and never collide with a real NPI.
+    """
+    column = 'npi' if 'npi' in df.columns else 'NPI'
+    npis = pd.to_numeric(df[column], errors='coerce')
+    missing = npis.isna().to_numpy()
+    keys = npis.fillna(0).to_numpy(dtype='int64')
+    if missing.any():
+        # Every provider column, so keys hashed from plan rows and from the provider table agree
+        records = df.loc[missing].reindex(columns=PROVIDER_COLUMNS).astype('str')
+        hashes = pd.util.hash_pandas_object(records, index=False).to_numpy()
+        keys[missing] = -(hashes >> np.uint64(1)).astype('int64') - 1
+    return keys
+
+
+class ProviderDimension:
+    """Provider records keyed by NPI, shared by every plan.
+
+    Plans store an int32 provider_id per row instead of repeating the name,
+    address and phone columns; ids are positions in `table` and never change
+    once assigned, so the table only grows as plans are loaded. Providers
+    without an NPI are keyed by their record (see provider_keys) and have a
+    null `npi`.
+    """
+
+    def __init__(self, zip_centroids: Optional[ZipCentroids] = None):
+        self.zip_centroids = zip_centroids
+        self.table = pd.DataFrame({'npi': pd.Series(dtype='Int64'),
+                                   **{column: pd.Series(dtype='str') for column in PROVIDER_COLUMNS}})
+        self.latitudes = np.empty(0)
+        self.longitudes = np.empty(0)
+        self._keys = pd.Index([], dtype='int64')
+        self.search_index = ProviderSearchIndex()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_table(cls, table: pd.DataFrame, latitudes: np.ndarray, longitudes: np.ndarray,
+                   arrays: Optional[Dict[str, np.ndarray]] = None) -> 'ProviderDimension':
+        """A dimension over an existing provider table, e.g. one attached from shared memory.
+
+        With the `arrays()` of the dimension the table came from, its key and
+        name indexes are used as they are instead of being rebuilt.
+        """
+        dimension = cls()
+        dimension.table = table.astype({'npi': 'Int64'})
+        dimension.latitudes = latitudes
+        dimension.longitudes = longitudes
+        if arrays is None:
+            dimension.search_index = ProviderSearchIndex().extend(table[LEGAL_NAME_COLUMN], table[OTHER_NAME_COLUMN])
+            dimension._keys = pd.Index(provider_keys(dimension.table))
+        else:
+            dimension.search_index = ProviderSearchIndex.from_arrays(under_prefix('search_index', arrays))
+            dimension._keys = pd.Index(arrays['keys'], copy=False)
+        return dimension
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The key and name index arrays for from_table"""
+        return {'keys': self._keys.to_numpy(), **with_prefix('search_index', self.search_index.arrays())}
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def intern(self, df: pd.DataFrame) -> np.ndarray:
+        """Return provider ids for the rows of a plan frame, adding unseen providers"""
+        keys = provider_keys(df)
+        with self._lock:
+            ids = self._keys.get_indexer(keys)
+            new = ids < 0
+            if new.any():
+                self._append(df.loc[new], keys[new])
+                ids = self._keys.get_indexer(keys)
+        return ids.astype('int32')
+
+    def _append(self, df: pd.DataFrame, keys: np.ndarray):
+        columns = [column for column in PROVIDER_COLUMNS if column in df.columns]
+        rows = df[columns].assign(key=keys).drop_duplicates('key')
+        keys = rows['key'].to_numpy()
+        rows['npi'] = pd.Series(keys, index=rows.index, dtype='Int64').where(keys >= 0)
+        rows = rows.reindex(columns=['npi'] + PROVIDER_COLUMNS)
+        for column in PROVIDER_COLUMNS:
+            rows[column] = _text(rows[column])
+
+        table = self.table.copy()
+        for column in CATEGORICAL_PROVIDER_COLUMNS:
+            table[column] = _text(table[column])
+        table = pd.concat([table, rows], ignore_index=True)
+        table = table.astype({column: 'category' for column in CATEGORICAL_PROVIDER_COLUMNS})
+
+        if self.zip_centroids is not None:
+            lats, lons = self.zip_centroids.coordinates(rows[POSTAL_CODE_COLUMN])
+        else:
+            lats = lons = np.full(len(rows), np.nan)
+
+        # Only the new providers are indexed, into a copy, so readers never see a half-updated index
+        search_index = self.search_index.extend(rows[LEGAL_NAME_COLUMN], rows[OTHER_NAME_COLUMN])
+
+        # Publish the new arrays before the NPI index so concurrent readers never see unknown ids
+        self.table = table
+        self.latitudes = np.concatenate([self.latitudes, lats])
+        self.longitudes = np.concatenate([self.longitudes, lons])
+        self.search_index = search_index
+        self._keys = pd.Index(np.concatenate([self._keys.to_numpy(), keys]))
+
+    def ids_for_npis(self, npis) -> np.ndarray:
+        """Provider ids of the given NPIs; unknown NPIs are skipped"""
+        npis = pd.to_numeric(pd.Series(list(npis), dtype='object'), errors='coerce')
+        # Only real NPIs; negative keys belong to providers without one
+        npis = npis[npis > 0].to_numpy(dtype='int64')
+        ids = self._keys.get_indexer(npis)
+        return ids[ids >= 0].astype('int32')
+
+    def search(self, term: str, limit: int = DEFAULT_LIMIT, provider_ids: Optional[np.ndarray] = None) -> List[Dict]:
+        """Ranked provider name suggestions, optionally restricted to the given provider ids"""
+        # The index is published after the table, so every id it returns is in the table read here
+        ranked = self.search_index.search(term, limit=limit, provider_ids=provider_ids)
+        rows = self.table.take(ranked)
+        return [
+            {"npi": None if pd.isna(npi) else int(npi),
+             "legal_name": legal_name if isinstance(legal_name, str) else None,
+             "other_name": other_name if isinstance(other_name, str) else None}
+            for npi, legal_name, other_name in zip(rows['npi'], rows[LEGAL_NAME_COLUMN], rows[OTHER_NAME_COLUMN])
+        ]
+
+    def take(self, provider_ids: np.ndarray) -> pd.DataFrame:
+        """Provider records for the given ids, in order"""
+        return self.table.take(np.asarray(provider_ids)).reset_index(drop=True)
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the provider table, coordinates, key index and name index"""
+        arrays = self.latitudes.nbytes + self.longitudes.nbytes + self._keys.nbytes
+        return int(self.table.memory_usage(index=True, deep=True).sum()) + arrays + self.search_index.memory_usage()
+
+
+class ProcedureDimension:
+    """Distinct (procedure_name, billing_code) pairs keyed by an int32 procedure_id, shared by every plan.
+
+    The autocomplete index covers every pair once; plans restrict its
+    matches to the procedure ids they price.
+    """
+
+    def __init__(self):
+        self.table = pd.DataFrame({'procedure_name': pd.Series(dtype='str'),
+                                   'billing_code': pd.Series(dtype='str')})
+        # Built on first use for a dimension over an existing table (see _id_lookup)
+        self._ids: Optional[Dict[Tuple[str, str], int]] = {}
+        self.search_index = ProcedureSearchIndex()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_table(cls, table: pd.DataFrame, arrays: Optional[Dict[str, np.ndarray]] = None) -> 'ProcedureDimension':
+        """A dimension over an existing procedure table, ids being row positions.
+
+        With the `arrays()` of the dimension the table came from, its
+        autocomplete index is used as it is instead of being rebuilt.
+        """
+        dimension = cls()
+        dimension.table = table
+        dimension._ids = None
+        if arrays is None:
+            dimension.search_index = ProcedureSearchIndex().extend(table['procedure_name'], table['billing_code'])
+        else:
+            dimension.search_index = ProcedureSearchIndex.from_arrays(under_prefix('search_index', arrays))
+        return dimension
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The autocomplete index arrays for from_table"""
+        return with_prefix('search_index', self.search_index.arrays())
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def _id_lookup(self) -> Dict[Tuple[str, str], int]:
+        """The (name, code) -> id dict, built from the table the first time it is needed"""
+        if self._ids is None:
+            self._ids = {key: i for i, key in enumerate(zip(self.table['procedure_name'], self.table['billing_code']))}
+        return self._ids
+
+    def intern(self, names: pd.Series, codes: pd.Series) -> np.ndarray:
+        """Return procedure ids for each (name, code) row, adding unseen pairs"""
+        keys = pd.MultiIndex.from_arrays([names.to_numpy(), codes.to_numpy()])
+        inverse, uniques = pd.factorize(keys)
+        with self._lock:
+            lookup = self._id_lookup()
+            new = [key for key in uniques if key not in lookup]
+            if new:
+                for key in new:
+                    lookup[key] = len(lookup)
+                rows = pd.DataFrame(new, columns=['procedure_name', 'billing_code'], dtype='object')
+                rows = rows.apply(_text)
+                self.table = pd.concat([self.table, rows], ignore_index=True)
+                # Published after the table, like the provider index, so readers only see known ids
+                self.search_index = self.search_index.extend(rows['procedure_name'], rows['billing_code'])
+            unique_ids = np.array([lookup[key] for key in uniques], dtype='int32')
+        return unique_ids[inverse]
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the procedure table, its (name, code) -> id lookup and the autocomplete index"""
+        ids = self._ids or {}
+        lookup = sys.getsizeof(ids) + sum(sys.getsizeof(key) for key in ids)
+        return int(self.table.memory_usage(index=True, deep=True).sum()) + lookup + self.search_index.memory_usage()
+
+    def search(self, term: str, limit: int = DEFAULT_LIMIT, procedure_ids: Optional[np.ndarray] = None) -> List[Dict]:
+        """Ranked procedure suggestions, optionally restricted to the given procedure ids"""
+        rows = self.table.take(self.search_index.rank(term, limit=limit, procedure_ids=procedure_ids))
+        return rows.to_dict('records')
+
+    def id_for(self, name: str, code: str) -> Optional[int]:
+        return self._id_lookup().get((name, code))
@@ -0,0 +1,127 @@
+"""ZIP code centroids, vectorized haversine distances and a grid spatial index.
+
+The bundled static/geo/zip_centroids.csv.gz maps 5-digit US ZIP codes to
+their approximate centroid. It is derived from the MIT-licensed `zipcodes`
+package data (see static/geo/LICENSE for its notice) and needs no network
+access at runtime.
+"""
+import logging
+import os
+import sys
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_MILES = 3959.87433
+MILES_PER_DEGREE_LAT = 69.0
+
+DEFAULT_CENTROIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'geo', 'zip_centroids.csv.gz')
+
+# Grid cell size in degrees; roughly 17 miles of latitude per cell
+GRID_CELL_DEGREES = 0.25
+
+
+def zip5(values: pd.Series) -> pd.Series:
+    """Reduce postal codes (ZIP+4, numbers, strings) to their 5-digit ZIP"""
+    codes = values.astype('str').str.replace(r'\.0$', '', regex=True).str.strip()
+    # Numeric postal codes lose leading zeros ('2134' -> '02134', '21341234' -> '021341234')
+    codes = codes.where(~codes.str.len().isin([4, 8]), '0' + codes)
+    return codes.str[:5]
+
+
+def haversine_miles(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distance in miles from one point to arrays of points"""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class ZipCentroids:
+    """Offline ZIP code -> (latitude, longitude) table"""
+
+    def __init__(self, table: pd.DataFrame):
+        self.table = table
+        self._index = pd.Index(table.index)
+        self._lats = table['lat'].to_numpy(dtype='float64')
+        self._lons = table['lon'].to_numpy(dtype='float64')
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CENTROIDS_PATH) -> 'ZipCentroids':
+        """Load the centroid table; an empty table is used if the file is missing"""
+        try:
+            table = pd.read_csv(path, dtype={'zip': 'str', 'lat': 'float64', 'lon': 'float64'})
+        except FileNotFoundError:
+            logger.warning(f"ZIP centroid table not found at {path}; distance filters are disabled")
+            table = pd.DataFrame({'zip': pd.Series(dtype='str'), 'lat': [], 'lon': []})
+        table = table.drop_duplicates('zip').set_index('zip')
+        logger.info(f"Loaded {len(table)} ZIP centroids")
+        return cls(table)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def lookup(self, zipcode) -> Optional[Tuple[float, float]]:
+        """Coordinates of a single ZIP code, or None if unknown"""
+        if zipcode is None:
+            return None
+        position = self._index.get_indexer(zip5(pd.Series([zipcode])))[0]
+        if position < 0:
+            return None
+        return float(self._lats[position]), float(self._lons[position])
+
+    def coordinates(self, postal_codes: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized lookup; unknown ZIP codes get NaN coordinates"""
+        positions = self._index.get_indexer(zip5(postal_codes))
+        known = positions >= 0
+        lats = np.full(len(positions), np.nan)
+        lons = np.full(len(positions), np.nan)
+        lats[known] = self._lats[positions[known]]
+        lons[known] = self._lons[positions[known]]
+        return lats, lons
+
+
+class GridIndex:
+    """Uniform lat/lon grid over row coordinates.
+
+    Each cell keeps the sorted row positions that fall inside it, so a radius
+    query only inspects the cells overlapping the search circle and can
+    restrict them to a row range with searchsorted.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, cell_degrees: float = GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        positions = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+        cell_lat = np.floor(lats[positions] / cell_degrees).astype('int64')
+        cell_lon = np.floor(lons[positions] / cell_degrees).astype('int64')
+
+        self.cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(positions):
+            groups = pd.Series(positions).groupby([cell_lat, cell_lon], sort=False)
+            for cell, rows in groups:
+                self.cells[cell] = np.sort(rows.to_numpy())
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the cells and their row arrays"""
+        return sys.getsizeof(self.cells) + sum(sys.getsizeof(cell) + sys.getsizeof(rows) for cell, rows in self.cells.items())
+
+    def candidates(self, lat: float, lon: float, radius: float, start: int, stop: int) -> np.ndarray:
+        """Row positions in [start, stop) from cells overlapping the radius' bounding box"""
+        dlat = radius / MILES_PER_DEGREE_LAT
+        dlon = radius / (MILES_PER_DEGREE_LAT * max(np.cos(np.radians(lat)), 0.01))
+        lat_cells = range(int(np.floor((lat - dlat) / self.cell_degrees)), int(np.floor((lat + dlat) / self.cell_degrees)) + 1)
+        lon_cells = range(int(np.floor((lon - dlon) / self.cell_degrees)), int(np.floor((lon + dlon) / self.cell_degrees)) + 1)
+
+        if len(lat_cells) * len(lon_cells) > len(self.cells):
+            # A box larger than the occupied grid: filter the occupied cells instead of walking the box
+            cells = [rows for (i, j), rows in self.cells.items() if i in lat_cells and j in lon_cells]
+        else:
+            cells = [self.cells[cell] for cell in ((i, j) for i in lat_cells for j in lon_cells) if cell in self.cells]
+
+        chunks = [rows[np.searchsorted(rows, start):np.searchsorted(rows, stop)] for rows in cells]
+        if not chunks:
+            return np.empty(0, dtype='int64')
+        return np.concatenate(chunks)
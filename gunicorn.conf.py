@@ -0,0 +1,26 @@
+"""Prefork deployment with plans shared between workers.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The master publishes the dataset to SHARED_DATA_DIR (a tmpfs, /dev/shm by
+default) once before forking; each worker's DataProcessor maps its fact
+tables and the search and stats indexes over them read-only instead of
+building its own (see shared_dataset.py for what a worker still costs).
+To roll out new data without a restart, run `python shared_dataset.py` again: workers swap
+to the new version on their next RELOAD_INTERVAL check.
+"""
+import os
+
+from shared_dataset import DEFAULT_SHARED_DIR
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+
+# Inherited by the workers
+os.environ.setdefault('SHARED_DATA_DIR', DEFAULT_SHARED_DIR)
+os.environ.setdefault('RELOAD_INTERVAL', '30')
+
+
+def on_starting(server):
+    from shared_dataset import main as publish
+    publish([os.getenv('DATA_DIR', os.path.join('static', 'data')), '--shared-dir', os.environ['SHARED_DATA_DIR']])
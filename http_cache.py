@@ -0,0 +1,109 @@
+"""Pre-encoded JSON responses with compressed variants and strong ETags.
+
+Autocomplete and stats endpoints are called on every keystroke with a small
+set of repeating queries. Their final response bytes (plus gzip/brotli
+variants) are cached per normalized query, so a repeat request skips both the
+data lookup and JSON encoding, and a client that already holds the body gets
+a 304 from its If-None-Match header.
+"""
+import gzip
+import hashlib
+import json
+import logging
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from flask import Request, Response
+
+from cache import ResultCache
+from metrics import span
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is an optional extra
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 512
+
+IDENTITY = 'identity'
+
+
+def _json_default(value):
+    """Encode numpy scalars and arrays like their Python equivalents"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(value) -> bytes:
+    """Compact JSON with sorted keys, as Flask's jsonify produces"""
+    return json.dumps(value, separators=(',', ':'), sort_keys=True, default=_json_default).encode('utf-8')
+
+
+class EncodedResponse:
+    """JSON body encoded once, with its compressed variants and ETag"""
+
+    def __init__(self, body: bytes, version: str, status: int = 200, negative: bool = False):
+        self.status = status
+        self.negative = negative
+        self.digest = f"{version}-{hashlib.sha1(body).hexdigest()[:16]}"
+        self.variants: Dict[str, bytes] = {IDENTITY: body}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.variants['gzip'] = gzip.compress(body, compresslevel=6, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body)
+
+    @classmethod
+    def from_value(cls, value, version: str, status: int = 200, negative: bool = False) -> 'EncodedResponse':
+        return cls(encode_json(value), version, status=status, negative=negative)
+
+    def etag(self, encoding: str) -> str:
+        """Strong ETag per representation, so compressed and plain bodies never share one"""
+        return self.digest if encoding == IDENTITY else f"{self.digest}-{encoding}"
+
+    def choose_encoding(self, request: Request) -> str:
+        accepted = [encoding for encoding in ('br', 'gzip') if encoding in self.variants]
+        return request.accept_encodings.best_match(accepted) or IDENTITY
+
+    def to_response(self, request: Request, max_age: int = 0) -> Response:
+        """Build the response for a request, answering 304 when its If-None-Match matches"""
+        encoding = self.choose_encoding(request)
+        etag = self.etag(encoding)
+
+        if self.status == 200 and request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], status=self.status, mimetype='application/json')
+            if encoding != IDENTITY:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f"public, max-age={max_age}" if max_age else 'no-cache'
+        return response
+
+
+class ResponseCache:
+    """EncodedResponse objects keyed by dataset version and normalized query"""
+
+    def __init__(self, cache: ResultCache, max_age: int = 0):
+        self.cache = cache
+        self.max_age = max_age
+
+    def respond(self, request: Request, version: str, key: str, compute: Callable[[], object],
+                negative: Optional[Callable[[object], bool]] = None) -> Response:
+        """Serve the cached encoding of compute() for key, encoding it only on a miss"""
+        def encode():
+            value = compute()
+            with span('encode'):
+                return EncodedResponse.from_value(value, version, negative=bool(negative and negative(value)))
+
+        payload = self.cache.get_or_compute(f"{version}:{key}", encode, negative=lambda payload: payload.negative)
+        return payload.to_response(request, max_age=self.max_age)
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
@@ -0,0 +1,527 @@
+"""Convert plan CSV files into typed, memory-mappable Arrow IPC files.
+
+Usage:
+    python ingest.py [data_dir] [--force]
+    python ingest.py [data_dir] --raw FILE_OR_DIR [...] [--workers N] [--chunk-rows N] [--keep-versions N]
+
+Each Austin_*_data.csv / summary_Austin_*.csv (optionally gzipped) gets an
+uncompressed Arrow IPC sibling with the same stem and a .arrow extension.
+DataProcessor.load_data memory-maps those files when they are newer than the
+CSV, so loading skips CSV parsing and type inference. Each process still
+interns a loaded plan into its own private fact arrays (see PlanIndex), so
+the mapped pages are not shared between workers; shared_dataset.py publishes
+the fact tables themselves for that.
+
+With --raw, raw plan files are instead streamed in chunks (one process per
+plan) into a new dataset version under data_dir/versions/<version>/: the
+sorted data file, its summary statistics, a procedure offsets index and a
+manifest.json. Plans not given are carried over from the previous version,
+and data_dir/CURRENT is switched to the new version only once it is complete.
+Older versions beyond --keep-versions are then deleted.
+Memory per worker is bounded by --chunk-rows (plus the largest single
+procedure), not by the size of the plan.
+
+Requires pyarrow, which is in requirements-extras.txt rather than
+requirements.txt; without it the app reads the CSV files directly.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from dimensions import PROVIDER_COLUMNS
+from plan_index import normalize_billing_code, sort_plan_frame
+from stats_index import SUMMARY_STAT_COLUMNS, compute_stats
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - exercised only without pyarrow installed
+    pa = None
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_EXTENSION = '.arrow'
+CSV_EXTENSIONS = ('.csv', '.csv.gz')
+
+VERSIONS_DIR = 'versions'
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+INDEX_DIR = 'indexes'
+PROCEDURE_INDEX_SUFFIX = '.procedures' + COLUMNAR_EXTENSION
+
+DEFAULT_CHUNK_ROWS = 250_000
+
+# Versions kept besides the current one, for servers that have not reloaded yet
+KEEP_PREVIOUS_VERSIONS = 1
+
+DATA_DTYPES: Dict[str, str] = {
+    'procedure_name': 'str',
+    'negotiated_rate': 'float64',
+    'npi': 'Int64',
+    'billing_code': 'str',
+    'NPI': 'Int64',
+    **{column: 'str' for column in PROVIDER_COLUMNS},
+}
+
+SUMMARY_DTYPES: Dict[str, str] = {
+    'billing_code': 'str',
+    'procedure_name': 'str',
+    **{column: 'float64' for column in SUMMARY_STAT_COLUMNS},
+}
+
+
+def columnar_available() -> bool:
+    """Whether pyarrow is installed"""
+    return pa is not None
+
+
+def csv_stem(filename: str) -> Optional[str]:
+    """Return the filename without its .csv/.csv.gz extension, or None"""
+    for extension in CSV_EXTENSIONS:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return None
+
+
+def columnar_path(csv_path: str) -> str:
+    """Path of the columnar file that mirrors a CSV file"""
+    directory, filename = os.path.split(csv_path)
+    return os.path.join(directory, csv_stem(filename) + COLUMNAR_EXTENSION)
+
+
+def is_summary_file(filename: str) -> bool:
+    return os.path.basename(filename).startswith('summary_')
+
+
+def is_columnar_fresh(csv_path: str) -> bool:
+    """True if the columnar sibling exists and is at least as new as the CSV"""
+    path = columnar_path(csv_path)
+    if not os.path.exists(path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return os.path.getmtime(path) >= os.path.getmtime(csv_path)
+
+
+def discover_sources(directory: str) -> Dict[str, str]:
+    """Map each logical CSV filename in a directory to the path to load it from.
+    
+    A columnar (.arrow) sibling is preferred when pyarrow is installed and the
+    file is at least as new as its CSV; otherwise the CSV is used.
+    """
+    sources = {}
+    filenames = sorted(os.listdir(directory))
+    for filename in filenames:
+        stem = csv_stem(filename)
+        if stem is None or f"{stem}.csv" in sources:
+            continue
+        file_path = os.path.join(directory, filename)
+        if columnar_available() and is_columnar_fresh(file_path):
+            file_path = columnar_path(file_path)
+        sources[f"{stem}.csv"] = file_path
+    
+    if columnar_available():
+        # Columnar files shipped without their CSV
+        for filename in filenames:
+            if filename.endswith(COLUMNAR_EXTENSION):
+                stem = filename[:-len(COLUMNAR_EXTENSION)]
+                sources.setdefault(f"{stem}.csv", os.path.join(directory, filename))
+    return sources
+
+
+def read_csv_typed(csv_path: str) -> pd.DataFrame:
+    """Read a plan or summary CSV with explicit dtypes for the known columns"""
+    dtypes = SUMMARY_DTYPES if is_summary_file(csv_path) else DATA_DTYPES
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtype = {column: dtypes[column] for column in header if column in dtypes}
+    return pd.read_csv(csv_path, dtype=dtype)
+
+
+def read_columnar(path: str) -> pd.DataFrame:
+    """Memory-map an Arrow IPC file and expose it as a DataFrame.
+
+    Numeric columns without nulls are zero-copy views onto the mapped file;
+    they stay shared only as long as callers do not copy them.
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required to read columnar files")
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def file_digest(path: str) -> str:
+    """SHA-1 of a file's bytes, read in blocks"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(files: Dict[str, str], digest_of=file_digest) -> str:
+    """Hash of a set of files' names, sizes and content digests (never their paths or mtimes)"""
+    digest = hashlib.sha1()
+    for name, path in sorted(files.items()):
+        try:
+            size = os.path.getsize(path)
+            content = digest_of(path)
+        except OSError:
+            continue
+        digest.update(f"{name}:{size}:{content};".encode())
+    return digest.hexdigest()
+
+
+def read_manifest(directory: str) -> Optional[Dict]:
+    """The manifest.json of a dataset version directory, or None"""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def procedure_index_path(path: str) -> str:
+    """Path of the procedure offsets index written next to a versioned data file"""
+    directory, filename = os.path.split(path)
+    stem = filename[:-len(COLUMNAR_EXTENSION)] if filename.endswith(COLUMNAR_EXTENSION) else csv_stem(filename)
+    return os.path.join(directory, INDEX_DIR, stem + PROCEDURE_INDEX_SUFFIX)
+
+
+def read_procedure_pairs(path: str) -> pd.DataFrame:
+    """Read only the distinct (procedure_name, billing_code) pairs of a plan or summary file"""
+    columns = ['procedure_name', 'billing_code']
+    index_path = procedure_index_path(path)
+    if feather is not None and os.path.exists(index_path):
+        return feather.read_table(index_path, columns=columns).to_pandas()
+    if path.endswith(COLUMNAR_EXTENSION):
+        df = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    else:
+        df = pd.read_csv(path, usecols=columns, dtype='str')
+    return df.dropna(subset=['procedure_name']).drop_duplicates()
+
+
+def write_columnar(df: pd.DataFrame, path: str):
+    """Write a DataFrame as an uncompressed Arrow IPC file (required for memory-mapping)"""
+    if pa is None:
+        raise ImportError("pyarrow is required to write columnar files")
+    tmp_path = f"{path}.tmp"
+    feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def prepare_frame(csv_path: str) -> pd.DataFrame:
+    """Read a CSV and put it in the layout DataProcessor expects at load time"""
+    df = read_csv_typed(csv_path)
+    if not is_summary_file(csv_path):
+        # Store data files pre-sorted so loading them needs no re-sort or copy
+        df = sort_plan_frame(df)
+    return df
+
+
+def convert_file(csv_path: str, force: bool = False) -> bool:
+    """Convert one CSV to its columnar sibling; returns True if a file was written"""
+    if not force and is_columnar_fresh(csv_path):
+        logger.info(f"Up to date: {columnar_path(csv_path)}")
+        return False
+    df = prepare_frame(csv_path)
+    write_columnar(df, columnar_path(csv_path))
+    logger.info(f"Wrote {columnar_path(csv_path)} ({len(df)} rows)")
+    return True
+
+
+def convert_data_dir(data_dir: str, force: bool = False) -> List[str]:
+    """Convert every plan and summary CSV in data_dir; returns the files written"""
+    written = []
+    for filename in sorted(os.listdir(data_dir)):
+        if csv_stem(filename) is None:
+            continue
+        csv_path = os.path.join(data_dir, filename)
+        if convert_file(csv_path, force=force):
+            written.append(columnar_path(csv_path))
+    return written
+
+
+def resolve_dataset_dir(data_dir: str) -> str:
+    """The directory of the current dataset version, or data_dir itself if none is published"""
+    try:
+        with open(os.path.join(data_dir, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return data_dir
+    version_dir = os.path.join(data_dir, VERSIONS_DIR, version)
+    if not os.path.isdir(version_dir):
+        logger.warning(f"{CURRENT_FILE} points to missing version {version}; using {data_dir}")
+        return data_dir
+    return version_dir
+
+
+def _arrow_schema(columns) -> 'pa.Schema':
+    """Arrow types for a plan file's columns; unknown columns are kept as strings"""
+    types = {'str': pa.string(), 'float64': pa.float64(), 'Int64': pa.int64()}
+    return pa.schema([(column, types[DATA_DTYPES.get(column, 'str')]) for column in columns])
+
+
+def _bucket_procedures(counts: Counter, rows_per_bucket: int) -> Dict[str, int]:
+    """Split sorted procedure names into contiguous buckets of about rows_per_bucket rows"""
+    buckets = {}
+    bucket, rows = 0, 0
+    for name in sorted(counts):
+        if rows and rows + counts[name] > rows_per_bucket:
+            bucket, rows = bucket + 1, 0
+        buckets[name] = bucket
+        rows += counts[name]
+    return buckets
+
+
+def _summarize(df: pd.DataFrame) -> pd.DataFrame:
+    """Summary-file rows for a frame holding every row of its procedures"""
+    records = [
+        {'billing_code': code, 'procedure_name': name, **compute_stats(group['negotiated_rate'].to_numpy())}
+        for (name, code), group in df.groupby(['procedure_name', 'billing_code'], sort=True)
+    ]
+    return pd.DataFrame(records, columns=['billing_code', 'procedure_name'] + SUMMARY_STAT_COLUMNS)
+
+
+def _append_spill(path: str, rows: pd.DataFrame, schema: 'pa.Schema'):
+    """Append rows to a spill file as one more Arrow stream, closing it again"""
+    with pa.OSFile(path, 'ab') as sink, pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(pa.Table.from_pandas(rows, schema=schema, preserve_index=False))
+
+
+def _read_spill(path: str) -> 'pa.Table':
+    """Every stream appended to a spill file, as one table"""
+    tables = []
+    with pa.memory_map(path, 'r') as source:
+        while source.tell() < source.size():
+            tables.append(pa.ipc.open_stream(source).read_all())
+    return pa.concat_tables(tables)
+
+
+def ingest_plan(raw_path: str, out_dir: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Dict:
+    """Stream one raw plan CSV into a sorted data file, summary and procedure index in out_dir.
+    
+    Pass one counts rows per procedure; pass two spills each chunk's rows into
+    buckets of whole procedures, in name order; each bucket is then sorted by
+    (procedure_name, negotiated_rate), summarized exactly and appended to the
+    data file. Spill files are opened only while a chunk is appended to them,
+    so the number of buckets is not limited by open file descriptors.
+    Returns the plan's manifest entry.
+    """
+    stem = csv_stem(os.path.basename(raw_path))
+    plan_stem = stem[:-len('_data')]
+    header = pd.read_csv(raw_path, nrows=0).columns
+    dtype = {column: DATA_DTYPES.get(column, 'str') for column in header}
+    schema = _arrow_schema(header)
+
+    counts = Counter()
+    for chunk in pd.read_csv(raw_path, usecols=['procedure_name'], dtype='str', chunksize=chunk_rows):
+        counts.update(chunk['procedure_name'].dropna().value_counts().to_dict())
+    buckets = _bucket_procedures(counts, chunk_rows)
+    bucket_count = max(buckets.values(), default=-1) + 1
+
+    spill_dir = tempfile.mkdtemp(prefix=f"{stem}.", dir=out_dir)
+    try:
+        for chunk in pd.read_csv(raw_path, dtype=dtype, chunksize=chunk_rows):
+            chunk = chunk.dropna(subset=['procedure_name'])
+            chunk['billing_code'] = chunk['billing_code'].map(normalize_billing_code)
+            for bucket, rows in chunk.groupby(chunk['procedure_name'].map(buckets), sort=False):
+                _append_spill(os.path.join(spill_dir, f"{bucket}.arrow"), rows, schema)
+
+        data_path = os.path.join(out_dir, stem + COLUMNAR_EXTENSION)
+        summaries, index, offset = [], [], 0
+        with pa.OSFile(f"{data_path}.tmp", 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for bucket in range(bucket_count):
+                df = _read_spill(os.path.join(spill_dir, f"{bucket}.arrow")).to_pandas()
+                df = df.sort_values(['procedure_name', 'negotiated_rate'], kind='stable', na_position='last')
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+
+                summaries.append(_summarize(df))
+                positions = pd.Series(np.arange(offset, offset + len(df)), index=df.index)
+                bounds = positions.groupby([df['procedure_name'], df['billing_code']], sort=True).agg(['min', 'max'])
+                index.append(pd.DataFrame({
+                    'procedure_name': bounds.index.get_level_values(0),
+                    'billing_code': bounds.index.get_level_values(1),
+                    'start': bounds['min'].to_numpy(),
+                    'stop': bounds['max'].to_numpy() + 1,
+                }))
+                offset += len(df)
+        os.replace(f"{data_path}.tmp", data_path)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    summary = pd.concat(summaries, ignore_index=True) if summaries else _summarize(pd.DataFrame(
+        columns=['procedure_name', 'billing_code', 'negotiated_rate']))
+    summary_path = os.path.join(out_dir, f"summary_{plan_stem}{COLUMNAR_EXTENSION}")
+    write_columnar(summary, summary_path)
+
+    index_path = procedure_index_path(data_path)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    write_columnar(pd.concat(index, ignore_index=True) if index else
+                   pd.DataFrame(columns=['procedure_name', 'billing_code', 'start', 'stop']), index_path)
+
+    logger.info(f"Ingested {raw_path}: {offset} rows, {len(summary)} procedures in {bucket_count} buckets")
+    return {
+        'source': os.path.abspath(raw_path),
+        'source_size': os.path.getsize(raw_path),
+        'data': os.path.basename(data_path),
+        'summary': os.path.basename(summary_path),
+        'index': os.path.relpath(index_path, out_dir),
+        'rows': offset,
+        'procedures': len(summary),
+    }
+
+
+def _raw_plan_files(paths: List[str]) -> List[str]:
+    """Expand files and directories into raw Austin_*_data.csv(.gz) plan files"""
+    files = []
+    for path in paths:
+        names = sorted(os.listdir(path)) if os.path.isdir(path) else [os.path.basename(path)]
+        directory = path if os.path.isdir(path) else os.path.dirname(path)
+        for filename in names:
+            stem = csv_stem(filename)
+            if stem is None or is_summary_file(filename) or not stem.endswith('_data'):
+                if not os.path.isdir(path):
+                    logger.warning(f"Skipping {filename}: not an *_data.csv plan file")
+                continue
+            files.append(os.path.join(directory, filename))
+    return files
+
+
+def _carry_over(data_dir: str, version_dir: str, produced: set):
+    """Link the previous version's files (or convert flat-layout CSVs) for plans not re-ingested"""
+    for filename, source in discover_sources(resolve_dataset_dir(data_dir)).items():
+        stem = csv_stem(filename)
+        if stem in produced:
+            continue
+        target = os.path.join(version_dir, stem + COLUMNAR_EXTENSION)
+        if source.endswith(COLUMNAR_EXTENSION):
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+            index_path = procedure_index_path(source)
+            if os.path.exists(index_path):
+                os.makedirs(os.path.join(version_dir, INDEX_DIR), exist_ok=True)
+                shutil.copy2(index_path, procedure_index_path(target))
+        else:
+            write_columnar(prepare_frame(source), target)
+        logger.info(f"Carried over {os.path.basename(source)}")
+
+
+def publish_version(data_dir: str, version: str):
+    """Atomically point data_dir/CURRENT at a complete version"""
+    tmp_path = os.path.join(data_dir, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp_path, os.path.join(data_dir, CURRENT_FILE))
+
+
+def remove_old_versions(versions_dir: str, current: str, keep: int = KEEP_PREVIOUS_VERSIONS):
+    """Delete all but the `keep` newest versions besides the current one.
+
+    Directories still being built are left alone. Hard links carried over
+    into newer versions keep their data.
+    """
+    versions = sorted(
+        (entry for entry in os.scandir(versions_dir)
+         if entry.is_dir() and entry.name != current and not entry.name.endswith('.building')),
+        key=lambda entry: (entry.stat().st_mtime_ns, entry.name), reverse=True,
+    )
+    for entry in versions[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        logger.info(f"Removed old dataset version {entry.name}")
+
+
+def ingest_raw(raw_paths: List[str], data_dir: str, workers: Optional[int] = None,
+               chunk_rows: int = DEFAULT_CHUNK_ROWS, keep_versions: int = KEEP_PREVIOUS_VERSIONS) -> str:
+    """Build and publish a new dataset version from raw plan files; returns the version.
+
+    Only the current version and the `keep_versions` before it stay on disk.
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for ingestion")
+    files = _raw_plan_files(raw_paths)
+    if not files:
+        raise ValueError("No raw *_data.csv plan files given")
+
+    # Sortable by time; the suffix keeps ingests started in the same second apart
+    version = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+    versions_dir = os.path.join(data_dir, VERSIONS_DIR)
+    version_dir = os.path.join(versions_dir, version)
+    building_dir = f"{version_dir}.building"
+    os.makedirs(building_dir)
+    try:
+        workers = workers or min(len(files), os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                entries = list(pool.map(ingest_plan, files, [building_dir] * len(files), [chunk_rows] * len(files)))
+        else:
+            entries = [ingest_plan(path, building_dir, chunk_rows) for path in files]
+
+        produced = {entry['data'][:-len(COLUMNAR_EXTENSION)] for entry in entries}
+        produced |= {entry['summary'][:-len(COLUMNAR_EXTENSION)] for entry in entries}
+        _carry_over(data_dir, building_dir, produced)
+
+        files = sorted(filename for filename in os.listdir(building_dir) if filename.endswith(COLUMNAR_EXTENSION))
+        manifest = {
+            'version': version,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'chunk_rows': chunk_rows,
+            'plans': {entry['data']: entry for entry in entries},
+            'files': files,
+            # Same data, same hash, wherever and whenever it was ingested; the app's dataset version
+            'content_hash': content_hash({filename: os.path.join(building_dir, filename) for filename in files}),
+        }
+        with open(os.path.join(building_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(building_dir, version_dir)
+    except BaseException:
+        shutil.rmtree(building_dir, ignore_errors=True)
+        raise
+
+    publish_version(data_dir, version)
+    remove_old_versions(versions_dir, version, keep_versions)
+    logger.info(f"Published dataset version {version} ({len(entries)} plans ingested)")
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert plan CSV files to memory-mappable Arrow IPC files")
+    parser.add_argument('data_dir', nargs='?', default=os.path.join('static', 'data'))
+    parser.add_argument('--force', action='store_true', help="Rewrite files even if they are up to date")
+    parser.add_argument('--raw', nargs='+', metavar='PATH',
+                        help="Raw *_data.csv(.gz) plan files or directories to ingest into a new dataset version")
+    parser.add_argument('--workers', type=int, help="Plans ingested in parallel (default: one per CPU)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="Rows read per chunk; bounds each worker's memory")
+    parser.add_argument('--keep-versions', type=int, default=KEEP_PREVIOUS_VERSIONS,
+                        help="Previous dataset versions kept on disk after a --raw ingest")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if not columnar_available():
+        parser.error("pyarrow is not installed")
+    if args.raw:
+        ingest_raw(args.raw, args.data_dir, workers=args.workers, chunk_rows=args.chunk_rows,
+                   keep_versions=args.keep_versions)
+        return
+    written = convert_data_dir(args.data_dir, force=args.force)
+    logger.info(f"Converted {len(written)} files")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""Counters, histograms and timing spans exported in the Prometheus text format.
+
+Metrics live in a process-wide REGISTRY and are rendered by the /metrics
+endpoint. Values that already exist elsewhere (cache counters, loaded plan
+sizes) are copied in by collectors registered with `on_collect`, which run
+at scrape time, so the hot path only pays for what it measures itself.
+
+`span(stage)` times one stage of a request into STAGE_SECONDS and, while a
+request trace is active (see `start_trace`), also appends it to that trace so
+a slow request can be logged with its own breakdown.
+
+Under a prefork server every worker has its own registry; a scrape sees the
+worker that answered it, so scrape each worker or aggregate by instance.
+"""
+import contextvars
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+NAMESPACE = 'healthcare'
+
+# Seconds; cache hits are well under a millisecond, whole-plan loads take seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+BYTE_BUCKETS = tuple(256 * 4 ** i for i in range(10))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """A named metric with one value per combination of label values"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['Registry'] = None):
+        self.name = f"{NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def set(self, value: float, **labels):
+        """Set the value for a label set (collectors mirroring counts kept elsewhere)"""
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def clear(self):
+        """Forget every label set, e.g. before a collector re-reads plans that may have been evicted"""
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional['Registry'] = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts_and_sum = self._values.get(key)
+            if counts_and_sum is None:
+                counts_and_sum = self._values[key] = [[0] * len(self.buckets), 0.0]
+            counts, _ = counts_and_sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts_and_sum[1] += value
+
+    def set(self, value: float, **labels):
+        raise TypeError("Histograms can only be observed")
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ('le',), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics of this process plus collectors that refresh some of them at scrape time"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def on_collect(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Run the collectors, then format every metric for a scrape"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = Counter('http_requests_total', "HTTP requests by route, method and status", ['endpoint', 'method', 'status'])
+REQUEST_SECONDS = Histogram('http_request_seconds', "Time to build a response, by route", ['endpoint'])
+RESPONSE_BYTES = Histogram('http_response_bytes', "Response body size, by route (streamed bodies excluded)",
+                           ['endpoint'], buckets=BYTE_BUCKETS)
+RESULT_ROWS = Histogram('result_rows', "Rows matched by a search or quoted by a batch", ['endpoint'],
+                        buckets=ROW_BUCKETS)
+STAGE_SECONDS = Histogram('stage_seconds', "Time spent in one stage of a request", ['stage'])
+SLOW_REQUESTS = Counter('slow_requests_total', "Requests slower than SLOW_REQUEST_MS, by route", ['endpoint'])
+
+PLAN_LOAD_SECONDS = Histogram('plan_load_seconds', "Time to read and index one plan", ['plan'])
+PLAN_MEMORY_BYTES = Gauge('plan_memory_bytes', "Memory held by each loaded plan's fact table and indexes", ['plan'])
+PLAN_ROWS = Gauge('plan_rows', "Rows in each loaded plan", ['plan'])
+DIMENSION_MEMORY_BYTES = Gauge('dimension_memory_bytes',
+                               "Memory held by the provider and procedure tables and indexes shared by all plans", ['dimension'])
+DATASET_INFO = Gauge('dataset_info', "Version of the dataset being served", ['version'])
+RELOADS = Counter('dataset_reloads_total', "Datasets swapped in after the data files changed")
+
+CACHE_EVENTS = Counter('cache_events_total', "Cache lookups and maintenance by cache and event", ['cache', 'event'])
+CACHE_HIT_RATIO = Gauge('cache_hit_ratio', "Hits over lookups since start, by cache", ['cache'])
+CACHE_BYTES = Gauge('cache_bytes', "Estimated bytes held, by cache", ['cache'])
+CACHE_ENTRIES = Gauge('cache_entries', "Entries held, by cache", ['cache'])
+
+
+def collect_cache_stats(name: str, stats: Dict):
+    """Copy a cache's stats() counters into the cache metrics"""
+    for event, value in stats.items():
+        if event == 'hit_ratio':
+            CACHE_HIT_RATIO.set(value, cache=name)
+        elif event == 'bytes':
+            CACHE_BYTES.set(value, cache=name)
+        elif event == 'entries':
+            CACHE_ENTRIES.set(value, cache=name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and event != 'max_bytes':
+            CACHE_EVENTS.set(value, cache=name, event=event)
+    if 'hit_ratio' not in stats and 'hits' in stats:
+        lookups = stats['hits'] + stats.get('misses', 0)
+        CACHE_HIT_RATIO.set(stats['hits'] / lookups if lookups else 0.0, cache=name)
+
+
+_trace: contextvars.ContextVar = contextvars.ContextVar('metrics_trace', default=None)
+
+
+def start_trace() -> contextvars.Token:
+    """Collect the spans of the current request (until end_trace)"""
+    return _trace.set([])
+
+
+def end_trace(token: contextvars.Token) -> List[Tuple[str, float]]:
+    """Stop collecting and return the (stage, seconds) spans recorded since start_trace"""
+    spans = _trace.get() or []
+    _trace.reset(token)
+    return spans
+
+
+def record(stage: str, seconds: float):
+    """Record an already measured stage"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as one stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def format_spans(spans: List[Tuple[str, float]]) -> str:
+    """Spans summed per stage, slowest first, for a log line"""
+    totals: Dict[str, float] = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in
+                     sorted(totals.items(), key=lambda item: item[1], reverse=True))
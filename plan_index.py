@@ -0,0 +1,296 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dimensions import PROVIDER_COLUMNS, ProcedureDimension, ProviderDimension
+from geo import GridIndex, haversine_miles
+from search_index import DEFAULT_LIMIT, Postings, encode_keys, find_key, under_prefix, with_prefix
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_billing_code(value) -> str:
+    """Normalize a billing code to its string form ('11401.0' -> '11401')"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    code = str(value).strip()
+    if code.endswith('.0') and code[:-2].isdigit():
+        code = code[:-2]
+    return code
+
+
+def is_plan_sorted(df: pd.DataFrame) -> bool:
+    """True if rows are ordered by procedure name, then by negotiated rate within each procedure.
+
+    Missing names and rates are sorted last, as sort_plan_frame leaves them:
+    rows without a name after every named row, missing rates at the end of
+    their procedure's block.
+    """
+    named = int(df['procedure_name'].notna().sum())
+    names = df['procedure_name'].iloc[:named]
+    if names.hasnans or not names.is_monotonic_increasing:
+        return False
+    names = names.to_numpy()
+    rates = df['negotiated_rate'].to_numpy(dtype='float64')[:named]
+    missing = np.isnan(rates)
+    in_order = (rates[1:] >= rates[:-1]) & ~missing[:-1] | missing[1:]
+    return bool(np.all((names[1:] != names[:-1]) | in_order))
+
+
+def sort_plan_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalize billing codes and order a plan frame by procedure name, then rate.
+
+    Frames written by ingest.py are already in this order and pass through
+    without a copy.
+    """
+    if not pd.api.types.is_string_dtype(df['billing_code']):
+        df = df.assign(billing_code=df['billing_code'].map(normalize_billing_code))
+    if not is_plan_sorted(df):
+        df = df.sort_values(['procedure_name', 'negotiated_rate'], kind='stable', na_position='last')
+    return df.reset_index(drop=True)
+
+
+class PlanIndex:
+    """Compact fact table for one plan with row offsets per procedure and billing code.
+
+    Each row holds only (procedure_id, provider_id, negotiated_rate as float32);
+    procedure and provider details live in the shared dimension tables and are
+    joined only for rows that are returned. Rows are ordered by procedure name
+    so every procedure occupies one contiguous block, and lookups return that
+    block as a positional slice instead of scanning the whole table. Within a
+    block rows are ordered by rate, so price ranges are searchsorted slices and
+    the cheapest rows come first.
+
+    The lookups are arrays too: `procedure_offsets[i]` is the (start, stop)
+    block of `procedure_names[i]` (sorted, UTF-8), and `code_procedures` posts
+    the plan's procedure ids under each billing code. `from_facts` can take
+    them from another plan's `arrays()` instead of indexing the facts again.
+    """
+
+    def __init__(self, df: pd.DataFrame, providers: ProviderDimension, procedures: ProcedureDimension):
+        df = sort_plan_frame(df)
+        df = df.iloc[:int(df['procedure_name'].notna().sum())]
+
+        facts = pd.DataFrame({
+            'procedure_id': procedures.intern(df['procedure_name'], df['billing_code']),
+            'provider_id': providers.intern(df),
+            'negotiated_rate': df['negotiated_rate'].to_numpy(dtype='float32'),
+        })
+        self._index_facts(facts, providers, procedures)
+
+    @classmethod
+    def from_facts(cls, facts: pd.DataFrame, providers: ProviderDimension, procedures: ProcedureDimension,
+                   arrays: Optional[Dict[str, np.ndarray]] = None) -> 'PlanIndex':
+        """Index a fact table that is already in plan order, e.g. a read-only view from shared memory,
+        or use the arrays() of the plan it came from"""
+        plan_index = cls.__new__(cls)
+        plan_index._index_facts(facts, providers, procedures, arrays)
+        return plan_index
+
+    def _index_facts(self, facts: pd.DataFrame, providers: ProviderDimension, procedures: ProcedureDimension,
+                     arrays: Optional[Dict[str, np.ndarray]] = None):
+        self.providers = providers
+        self.procedures = procedures
+        self.facts = facts
+        self._grid = None
+        self._provider_ids = None
+        self._index_bytes: Optional[int] = None
+
+        if arrays is None:
+            arrays = self._build_arrays(facts, procedures)
+        self.procedure_names = arrays['procedure_names']
+        self.procedure_offsets = arrays['procedure_offsets']
+        # Procedures whose block holds more than one billing code need a mask on code lookup
+        self._mixed_procedures = arrays['mixed_procedures']
+        self._procedure_ids = arrays['procedure_ids']
+        # Position in procedure_names of each of _procedure_ids
+        self._procedure_positions = arrays['procedure_positions']
+        self.code_procedures = Postings.from_arrays(under_prefix('code_procedures', arrays))
+
+    @staticmethod
+    def _build_arrays(facts: pd.DataFrame, procedures: ProcedureDimension) -> Dict[str, np.ndarray]:
+        # Blocks per procedure_id, merged per name (a name's codes are adjacent in plan order)
+        procedure_ids = facts['procedure_id'].to_numpy()
+        bounds = pd.Series(np.arange(len(facts))).groupby(procedure_ids).agg(['min', 'max'])
+        ids = bounds.index.to_numpy().astype('int32')
+        names, positions, counts = np.unique(
+            encode_keys(procedures.table['procedure_name'].to_numpy()[ids]), return_inverse=True, return_counts=True,
+        )
+        offsets = bounds.groupby(positions).agg({'min': 'min', 'max': 'max'})
+        codes = procedures.table['billing_code'].to_numpy()[ids]
+        coded = np.array([isinstance(code, str) for code in codes], dtype=bool)
+        return {
+            'procedure_names': names,
+            'procedure_offsets': np.column_stack([offsets['min'], offsets['max'] + 1]).astype('int64'),
+            'mixed_procedures': counts > 1,
+            'procedure_ids': ids,
+            'procedure_positions': positions.astype('int32'),
+            **with_prefix('code_procedures', Postings.from_pairs(encode_keys(codes[coded]), ids[coded]).arrays()),
+        }
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The plan's lookup arrays, for from_facts over the same fact table"""
+        return {
+            'procedure_names': self.procedure_names,
+            'procedure_offsets': self.procedure_offsets,
+            'mixed_procedures': self._mixed_procedures,
+            'procedure_ids': self._procedure_ids,
+            'procedure_positions': self._procedure_positions,
+            **with_prefix('code_procedures', self.code_procedures.arrays()),
+        }
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    def procedure_rows(self) -> pd.Series:
+        """Rows per procedure name priced in this plan"""
+        return pd.Series(self.procedure_offsets[:, 1] - self.procedure_offsets[:, 0],
+                         index=np.strings.decode(self.procedure_names, 'utf-8').astype(object))
+
+    def procedure_pairs(self) -> pd.DataFrame:
+        """Distinct (procedure_name, billing_code) pairs priced in this plan"""
+        return self.procedures.table.take(self._procedure_ids).reset_index(drop=True)
+
+    def search_procedures(self, term: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+        """Autocomplete over the procedures priced in this plan, from the shared procedure index"""
+        return self.procedures.search(term, limit=limit, procedure_ids=self._procedure_ids)
+
+    def provider_ids(self) -> np.ndarray:
+        """Sorted ids of the providers priced in this plan"""
+        if self._provider_ids is None:
+            self._provider_ids = np.unique(self.facts['provider_id'].to_numpy())
+        return self._provider_ids
+
+    def matching_providers(self, rows: pd.DataFrame, provider: str) -> pd.DataFrame:
+        """Rows whose provider's legal or other name matches a name search"""
+        provider_ids = self.providers.search_index.match(provider)
+        return rows[np.isin(rows['provider_id'].to_numpy(), provider_ids)]
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the plan: its fact table plus every lookup structure built over it.
+
+        That is the procedure offsets, the billing code postings, the plan's
+        procedure ids and, once built, its grid and provider ids. The provider
+        and procedure dimensions, with the name indexes all plans search, are
+        shared and counted by Dataset.shared_memory_usage instead.
+        """
+        if self._index_bytes is None:
+            self._index_bytes = sum(array.nbytes for array in self.arrays().values())
+        size = int(self.facts.memory_usage(index=True).sum()) + self._index_bytes
+        # Built on first use
+        if self._grid is not None:
+            size += self._grid.memory_usage()
+        if self._provider_ids is not None:
+            size += self._provider_ids.nbytes
+        return size
+
+    def materialize(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """Join provider details onto fact rows, keeping only what callers return"""
+        providers = self.providers.take(rows['provider_id'].to_numpy())
+        result = pd.DataFrame({'negotiated_rate': rows['negotiated_rate'].to_numpy(dtype='float64').round(2)})
+        # Same column order as the original plan files: names, npi, then the practice address
+        for column in PROVIDER_COLUMNS[:2]:
+            result[column] = providers[column].to_numpy()
+        # Nullable, so providers without an NPI come back as None rather than NaN
+        result['npi'] = providers['npi'].array
+        for column in PROVIDER_COLUMNS[2:7]:
+            result[column] = providers[column].to_numpy()
+        if 'distance' in rows.columns:
+            result['distance'] = rows['distance'].to_numpy()
+        return result
+
+    @property
+    def grid(self) -> GridIndex:
+        if self._grid is None:
+            provider_ids = self.facts['provider_id'].to_numpy()
+            self._grid = GridIndex(self.providers.latitudes[provider_ids], self.providers.longitudes[provider_ids])
+        return self._grid
+
+    def distances_from(self, origin: Tuple[float, float], positions: np.ndarray) -> np.ndarray:
+        """Miles from origin to the given rows (NaN where the provider has no coordinates)"""
+        provider_ids = self.facts['provider_id'].to_numpy()[positions]
+        return haversine_miles(origin[0], origin[1],
+                               self.providers.latitudes[provider_ids], self.providers.longitudes[provider_ids])
+
+    def positions_near(self, origin: Tuple[float, float], radius: float,
+                       positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows among `positions` within radius miles of origin, with their distances.
+
+        Only rows in grid cells overlapping the search circle are measured.
+        """
+        positions = np.asarray(positions)
+        if len(positions) == 0:
+            return positions, np.empty(0)
+        start, stop = int(positions.min()), int(positions.max()) + 1
+        candidates = self.grid.candidates(origin[0], origin[1], radius, start, stop)
+        if len(positions) != stop - start:
+            candidates = candidates[np.isin(candidates, positions)]
+        # Back in row order, which is rate order within a procedure
+        candidates = np.sort(candidates)
+        distances = self.distances_from(origin, candidates)
+        keep = distances <= radius
+        return candidates[keep], distances[keep]
+
+    @staticmethod
+    def _price_slice(block: pd.DataFrame, min_price: Optional[float], max_price: Optional[float]) -> pd.DataFrame:
+        """Narrow a rate-sorted block to [min_price, max_price] with binary search"""
+        if min_price is None and max_price is None:
+            return block
+        rates = block['negotiated_rate'].to_numpy()
+        start = int(np.searchsorted(rates, np.float32(min_price), 'left')) if min_price is not None else 0
+        stop = int(np.searchsorted(rates, np.float32(max_price), 'right')) if max_price is not None else len(rates)
+        return block.iloc[start:max(start, stop)]
+
+    def rows_for_procedure(self, procedure: str, min_price: Optional[float] = None,
+                           max_price: Optional[float] = None) -> Optional[pd.DataFrame]:
+        """Return the rate-sorted fact rows for a procedure name, or None if it is not indexed"""
+        position = find_key(self.procedure_names, procedure)
+        if position < 0:
+            return None
+        return self._block(position, min_price, max_price)
+
+    def _block(self, position: int, min_price: Optional[float], max_price: Optional[float]) -> pd.DataFrame:
+        start, stop = self.procedure_offsets[position].tolist()
+        return self._price_slice(self.facts.iloc[start:stop], min_price, max_price)
+
+    def rows_for_code(self, billing_code: str, min_price: Optional[float] = None,
+                      max_price: Optional[float] = None) -> Optional[pd.DataFrame]:
+        """Return the fact rows for a billing code, or None if it is not indexed.
+
+        Rows are rate-sorted unless the code spans several procedure names.
+        """
+        procedure_ids = self.code_procedures.get(normalize_billing_code(billing_code))
+        if not len(procedure_ids):
+            return None
+
+        positions = self._procedure_positions[np.searchsorted(self._procedure_ids, procedure_ids)]
+        blocks = []
+        for procedure_id, position in zip(procedure_ids.tolist(), positions.tolist()):
+            block = self._block(position, min_price, max_price)
+            if self._mixed_procedures[position]:
+                block = block[block['procedure_id'] == procedure_id]
+            blocks.append(block)
+        return blocks[0] if len(blocks) == 1 else pd.concat(blocks)
+
+    def lookup(self, procedure: str, min_price: Optional[float] = None,
+               max_price: Optional[float] = None) -> Optional[pd.DataFrame]:
+        """Resolve a procedure name, falling back to a billing code, within an optional price range"""
+        rows = self.rows_for_procedure(procedure, min_price, max_price)
+        if rows is None:
+            rows = self.rows_for_code(procedure, min_price, max_price)
+        return rows
+
+    def batch_rows(self, procedures: List[str]) -> pd.DataFrame:
+        """Fact rows for several procedures (names or codes) at once, with an `item` column
+        giving the position of the matching procedure in the list"""
+        blocks, items = [], []
+        for item, procedure in enumerate(procedures):
+            rows = self.lookup(procedure)
+            if rows is not None and len(rows):
+                blocks.append(rows)
+                items.append(np.full(len(rows), item, dtype='int32'))
+        if not blocks:
+            return self.facts.iloc[:0].assign(item=np.empty(0, dtype='int32'))
+        return pd.concat(blocks).assign(item=np.concatenate(items))
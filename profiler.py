@@ -0,0 +1,124 @@
+"""Opt-in sampling profiler for individual slow requests.
+
+With PROFILE_SAMPLE_RATE > 0 that fraction of requests is profiled: a
+background thread records the request thread's stack every
+PROFILE_INTERVAL_MS. If the request then takes longer than SLOW_REQUEST_MS
+the samples are handed to the hooks in `slow_request_hooks` (by default:
+log the hottest stacks and, with PROFILE_DIR set, write them in the folded
+format that flamegraph.pl and speedscope read). Requests that are not
+sampled pay nothing, and sampled fast requests only pay for the sampler.
+"""
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Innermost frames kept per sample
+MAX_STACK_DEPTH = 64
+# Stacks shown in the log line of a slow request
+LOGGED_STACKS = 5
+
+
+def _folded_stack(frame) -> str:
+    """A frame's stack as 'outer;...;inner' with file:function:line entries"""
+    entries = []
+    while frame is not None and len(entries) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(entries))
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval until stopped"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self) -> 'SamplingProfiler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        """Stop sampling and return sample counts per folded stack"""
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.samples[_folded_stack(frame)] += 1
+
+
+def log_profile(profile: Dict):
+    hottest = profile['samples'].most_common(LOGGED_STACKS)
+    total = sum(profile['samples'].values())
+    # Innermost three frames of each stack, innermost first
+    stacks = '\n'.join(f"  {count}/{total} {' <- '.join(reversed(stack.split(';')[-3:]))}" for stack, count in hottest)
+    logger.warning(f"Profile of slow request {profile['request']} ({profile['seconds'] * 1000:.0f}ms):\n{stacks}")
+
+
+def write_folded(profile: Dict):
+    """Write the profile to PROFILE_DIR in folded format, one file per slow request"""
+    directory = os.getenv('PROFILE_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', profile['request'])[:80]
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.folded")
+    with open(path, 'w') as f:
+        for stack, count in profile['samples'].most_common():
+            f.write(f"{stack} {count}\n")
+
+
+# Called with {'request', 'seconds', 'samples'} for every profiled request over the threshold
+slow_request_hooks: List[Callable[[Dict], None]] = [log_profile, write_folded]
+
+
+class RequestProfiler:
+    """Decides which requests to sample and reports the slow ones to the hooks"""
+
+    def __init__(self, sample_rate: Optional[float] = None, slow_seconds: Optional[float] = None,
+                 interval: Optional[float] = None):
+        if sample_rate is None:
+            sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+        if slow_seconds is None:
+            slow_seconds = float(os.getenv('SLOW_REQUEST_MS', '1000')) / 1000
+        if interval is None:
+            interval = float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+
+    def start(self) -> Optional[SamplingProfiler]:
+        """Begin profiling the calling thread if this request is sampled"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return SamplingProfiler(threading.get_ident(), self.interval).start()
+
+    def finish(self, sampler: Optional[SamplingProfiler], request: str, seconds: float):
+        if sampler is None:
+            return
+        samples = sampler.stop()
+        if seconds < self.slow_seconds or not samples:
+            return
+        profile = {'request': request, 'seconds': seconds, 'samples': samples}
+        for hook in slow_request_hooks:
+            try:
+                hook(profile)
+            except Exception as e:
+                logger.error(f"Slow request hook failed: {str(e)}")
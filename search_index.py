@@ -0,0 +1,477 @@
+import copy
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_LIMIT = 25
+# Most suggestions an autocomplete request may ask for
+MAX_LIMIT = 100
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+# Ranking tiers, highest first
+SCORE_EXACT_CODE = 100
+SCORE_CODE_PREFIX = 90
+SCORE_NAME_PREFIX = 80
+SCORE_WORD_PREFIX = 60
+SCORE_SUBSTRING = 40
+SCORE_FUZZY = 20
+FUZZY_THRESHOLD = 0.6
+
+
+def normalize_text(text) -> str:
+    """Lowercase and collapse punctuation/whitespace to single spaces"""
+    if text is None:
+        return ''
+    return _NON_ALNUM.sub(' ', str(text).lower()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """Character trigrams of a normalized string, padded at word boundaries"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def encode_keys(values: Iterable[str]) -> np.ndarray:
+    """Strings as a bytes array of their UTF-8 encodings, which sort in the same order as the strings"""
+    encoded = [value.encode() for value in values]
+    return np.array(encoded, dtype='S') if encoded else np.empty(0, dtype='S1')
+
+
+def find_key(keys: np.ndarray, key: str) -> int:
+    """Position of key in a sorted bytes array, or -1"""
+    key = key.encode()
+    # A longer key cannot be present, and searching for it would cast the whole array to a wider dtype
+    if len(key) > keys.itemsize:
+        return -1
+    i = int(np.searchsorted(keys, key))
+    return i if i < len(keys) and keys[i] == key else -1
+
+
+def with_prefix(prefix: str, arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Arrays of a nested structure, named '<prefix>.<name>' in its owner's arrays()"""
+    return {f"{prefix}.{name}": array for name, array in arrays.items()}
+
+
+def under_prefix(prefix: str, arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """The arrays named by with_prefix(prefix, ...), under their own names"""
+    start = f"{prefix}."
+    return {name[len(start):]: array for name, array in arrays.items() if name.startswith(start)}
+
+
+_NO_IDS = np.empty(0, dtype='int32')
+
+# Joins an entry's normalized names; never part of a normalized name
+_NAME_SEPARATOR = '\n'
+
+
+class Postings:
+    """Sorted int32 entry ids per key, stored flat.
+
+    `keys` is a sorted bytes array (normalized text is ASCII; other text
+    goes through encode_keys) and the ids
+    posted under keys[i] are ids[offsets[i]:offsets[i + 1]]. Three arrays
+    cost a few bytes per (key, entry) pair, where a dict of sets costs a
+    hash table per key and an int object per entry. They are also all there
+    is to share: `arrays()` and `from_arrays` move postings between
+    processes without rebuilding them.
+    """
+
+    def __init__(self, keys: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None,
+                 ids: Optional[np.ndarray] = None):
+        self.keys = np.empty(0, dtype='S1') if keys is None else keys
+        self.offsets = np.zeros(1, dtype='int64') if offsets is None else offsets
+        self.ids = _NO_IDS if ids is None else ids
+
+    @classmethod
+    def from_pairs(cls, keys: np.ndarray, ids: np.ndarray) -> 'Postings':
+        """Postings of distinct (key, id) pairs given as a bytes array and an id array"""
+        ids = np.asarray(ids, dtype='int32')
+        order = np.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        return cls(keys[first], np.append(np.flatnonzero(first), len(keys)).astype('int64'), ids)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'Postings':
+        return cls(arrays['keys'], arrays['offsets'], arrays['ids'])
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {'keys': self.keys, 'offsets': self.offsets, 'ids': self.ids}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def merged(self, keys: List[str], ids: List[int]) -> 'Postings':
+        """A copy with (key, id) pairs added, leaving this one unchanged.
+
+        Pairs must be distinct and their ids above every id already posted,
+        as when entries are appended. Only the new keys are hashed and
+        searched for; the existing postings move with array operations.
+        """
+        if not keys:
+            return self
+        codes, pair_keys = pd.factorize(np.asarray(keys, dtype=object))
+        pair_keys = pair_keys.astype('S')
+        found = np.searchsorted(self.keys, pair_keys)
+        known = found < len(self.keys)
+        known[known] = self.keys[found[known]] == pair_keys[known]
+
+        # Keys not seen before are inserted in order; old key i moves up by the count inserted before it
+        added_order = np.argsort(pair_keys[~known], kind='stable')
+        added = pair_keys[~known][added_order]
+        inserted_at = np.searchsorted(self.keys, added)
+        old_positions = np.arange(len(self.keys)) + np.searchsorted(inserted_at, np.arange(len(self.keys)), 'right')
+        key_positions = np.empty(len(pair_keys), dtype='int64')
+        key_positions[known] = old_positions[found[known]]
+        key_positions[np.flatnonzero(~known)[added_order]] = inserted_at + np.arange(len(added))
+
+        pair_positions = key_positions[codes]
+        pair_ids = np.asarray(ids, dtype='int32')
+        order = np.lexsort((pair_ids, pair_positions))
+        # Both runs are sorted, and old ids precede new ones within a key, so a stable sort merges them
+        positions = np.concatenate([np.repeat(old_positions, np.diff(self.offsets)), pair_positions[order]])
+        merge = np.argsort(positions, kind='stable')
+        all_keys = np.insert(self.keys.astype(np.result_type(self.keys, added)), inserted_at, added)
+        offsets = np.searchsorted(positions[merge], np.arange(len(all_keys) + 1)).astype('int64')
+        return Postings(all_keys, offsets, np.concatenate([self.ids, pair_ids[order]])[merge])
+
+    def get(self, key: str) -> np.ndarray:
+        """Ids posted under key"""
+        i = find_key(self.keys, key)
+        return self.ids[self.offsets[i]:self.offsets[i + 1]] if i >= 0 else _NO_IDS
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """The [start, stop) range of keys starting with prefix"""
+        prefix = prefix.encode()
+        return (int(np.searchsorted(self.keys, prefix, 'left')),
+                int(np.searchsorted(self.keys, prefix + b'\xff', 'left')))
+
+    def union(self, start: int, stop: int) -> np.ndarray:
+        """Sorted distinct ids posted under keys[start:stop]"""
+        ids = self.ids[self.offsets[start]:self.offsets[stop]]
+        return np.unique(ids) if stop - start > 1 else ids
+
+    def memory_usage(self) -> int:
+        return self.keys.nbytes + self.offsets.nbytes + self.ids.nbytes
+
+
+def _restrict(ids: np.ndarray, entry_ids: Optional[np.ndarray]) -> np.ndarray:
+    """The ids among entry_ids only (all of them when entry_ids is None)"""
+    return ids if entry_ids is None else ids[np.isin(ids, entry_ids)]
+
+
+def _best_scores(ids: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct ids, sorted, each with the highest score it was given"""
+    order = np.lexsort((-scores, ids))
+    ids, scores = ids[order], scores[order]
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    return ids[first], scores[first]
+
+
+class _NameIndex:
+    """Word and trigram postings over one or more names per entry.
+
+    Entry ids are assigned in order of addition. An index is not modified
+    once built: `_extended` returns a copy with more entries, so readers of
+    the old index are never exposed to a half-updated one.
+
+    Each entry's normalized names, joined by _NAME_SEPARATOR, are stored in
+    one ASCII buffer: entry i is _text[_text_offsets[i]:_text_offsets[i + 1]],
+    its first name the first _primary_lengths[i] bytes. The buffer ends in as
+    many zero bytes as the longest entry, so any entry can be read as a
+    fixed-width window, and matches are scored over the candidates' texts as
+    one array.
+
+    Being flat arrays, an index can be rebuilt elsewhere from `arrays()` with
+    `from_arrays`, e.g. over read-only views of a file another process wrote.
+    """
+
+    def __init__(self):
+        self._text = np.empty(0, dtype='uint8')
+        self._text_offsets = np.zeros(1, dtype='int64')
+        self._primary_lengths = np.empty(0, dtype='int32')
+        self._tokens = Postings()
+        self._trigrams = Postings()
+        self._memory_usage: Optional[int] = None
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> '_NameIndex':
+        """An index over the arrays another index's arrays() returned, used as they are"""
+        index = cls()
+        index._set_arrays(arrays)
+        return index
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'text': self._text, 'text_offsets': self._text_offsets, 'primary_lengths': self._primary_lengths,
+            **with_prefix('tokens', self._tokens.arrays()), **with_prefix('trigrams', self._trigrams.arrays()),
+        }
+
+    def _set_arrays(self, arrays: Dict[str, np.ndarray]):
+        self._text = arrays['text']
+        self._text_offsets = arrays['text_offsets']
+        self._primary_lengths = arrays['primary_lengths']
+        self._tokens = Postings.from_arrays(under_prefix('tokens', arrays))
+        self._trigrams = Postings.from_arrays(under_prefix('trigrams', arrays))
+        self._memory_usage = None
+
+    def __len__(self) -> int:
+        return len(self._text_offsets) - 1
+
+    def _extended(self, names_per_entry: Iterable[Iterable]) -> '_NameIndex':
+        """A copy of the index with one entry added per item of names_per_entry"""
+        index = copy.copy(self)
+        index._append(names_per_entry)
+        return index
+
+    def _append(self, names_per_entry: Iterable[Iterable]):
+        texts, primary_lengths = [], []
+        token_keys, token_ids, gram_keys, gram_ids = [], [], [], []
+        for entry_id, entry_names in enumerate(names_per_entry, len(self)):
+            normalized = [name for name in (normalize_text(name) for name in entry_names) if name]
+            texts.append(_NAME_SEPARATOR.join(normalized).encode())
+            primary_lengths.append(len(normalized[0]) if normalized else 0)
+            tokens = {token for name in normalized for token in name.split()}
+            grams = set().union(*(trigrams(name) for name in normalized))
+            token_keys.extend(tokens)
+            token_ids.extend([entry_id] * len(tokens))
+            gram_keys.extend(grams)
+            gram_ids.extend([entry_id] * len(grams))
+
+        lengths = np.fromiter(map(len, texts), dtype='int64', count=len(texts))
+        end = self._text_offsets[-1]
+        padding = max(len(self._text) - end, int(lengths.max()) if len(lengths) else 0)
+        self._text = np.concatenate([self._text[:end], np.frombuffer(b''.join(texts), dtype='uint8'),
+                                     np.zeros(padding, dtype='uint8')])
+        self._text_offsets = np.concatenate([self._text_offsets, end + np.cumsum(lengths)])
+        self._primary_lengths = np.concatenate([self._primary_lengths, np.array(primary_lengths, dtype='int32')])
+        self._tokens = self._tokens.merged(token_keys, token_ids)
+        self._trigrams = self._trigrams.merged(gram_keys, gram_ids)
+        self._memory_usage = None
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the index (computed once: it never changes after construction)"""
+        if self._memory_usage is None:
+            names = self._text.nbytes + self._text_offsets.nbytes + self._primary_lengths.nbytes
+            postings = self._tokens.memory_usage() + self._trigrams.memory_usage()
+            self._memory_usage = names + postings + self._entry_bytes()
+        return self._memory_usage
+
+    def _entry_bytes(self) -> int:
+        """Bytes of the per-entry data a subclass keeps next to the names"""
+        return 0
+
+    def _texts(self, entry_ids: np.ndarray, lengths: Optional[np.ndarray] = None) -> np.ndarray:
+        """The entries' joined names (or their first `lengths` bytes) as a fixed-width bytes array"""
+        starts = self._text_offsets[entry_ids]
+        if lengths is None:
+            lengths = self._text_offsets[entry_ids + 1] - starts
+        width = int(lengths.max()) if len(lengths) else 0
+        if not width:
+            return np.zeros(len(entry_ids), dtype='S1')
+        # The trailing padding keeps every window inside the buffer; bytes past an entry's end are zeroed
+        chars = np.lib.stride_tricks.sliding_window_view(self._text, width)[starts]
+        chars *= np.arange(width) < lengths[:, None]
+        return chars.view(f"S{width}").ravel()
+
+    def _ranked(self, ids: np.ndarray, scores: np.ndarray, limit: int,
+                tiebreak: Optional[np.ndarray] = None) -> List[int]:
+        """Up to `limit` (0 for all) scored ids: best score first, then shortest first name,
+        then by first name, by tiebreak[id] if given and by id"""
+        lengths = self._primary_lengths[ids].astype('int64')
+        if limit and len(ids) > limit:
+            # Only entries that can reach the top `limit` on score and name length need their names compared
+            coarse = lengths - scores * (int(lengths.max()) + 1)
+            keep = coarse <= np.partition(coarse, limit - 1)[limit - 1]
+            ids, scores, lengths = ids[keep], scores[keep], lengths[keep]
+        names = self._texts(ids, lengths)
+        keys = [ids] + ([tiebreak[ids]] if tiebreak is not None else []) + [names, lengths, -scores]
+        order = np.lexsort(keys)
+        return ids[order[:limit] if limit else order].tolist()
+
+    def _word_prefix_matches(self, tokens: List[str], entry_ids: Optional[np.ndarray] = None) -> np.ndarray:
+        matched = None
+        for token in tokens:
+            ids = self._tokens.union(*self._tokens.prefix_range(token))
+            matched = _restrict(ids, entry_ids) if matched is None else np.intersect1d(matched, ids, assume_unique=True)
+            if not len(matched):
+                break
+        return _NO_IDS if matched is None else matched
+
+    def _trigram_matches(self, term: str, fuzzy: bool = True,
+                         entry_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        grams = trigrams(term)
+        candidates, counts = np.unique(np.concatenate([self._trigrams.get(gram) for gram in grams]),
+                                       return_counts=True)
+        if entry_ids is not None:
+            keep = np.isin(candidates, entry_ids)
+            candidates, counts = candidates[keep], counts[keep]
+        substring = np.strings.find(self._texts(candidates), term.encode()) >= 0
+        matched = substring
+        if fuzzy and len(term) >= 4:
+            matched = substring | (counts / len(grams) >= FUZZY_THRESHOLD)
+        return candidates[matched], np.where(substring[matched], SCORE_SUBSTRING, SCORE_FUZZY)
+
+    def _name_scores(self, term: str, fuzzy: bool = True,
+                     entry_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted ids of the entries (among entry_ids, if given) whose names match a normalized term,
+        with their scores"""
+        ids = self._word_prefix_matches(term.split(), entry_ids)
+        texts = self._texts(ids)
+        starts_name = (np.strings.startswith(texts, term.encode())
+                       | (np.strings.find(texts, (_NAME_SEPARATOR + term).encode()) >= 0))
+        scores = np.where(starts_name, SCORE_NAME_PREFIX, SCORE_WORD_PREFIX)
+
+        if len(term) >= 3:
+            trigram_ids, trigram_scores = self._trigram_matches(term, fuzzy, entry_ids)
+            ids, scores = np.concatenate([ids, trigram_ids]), np.concatenate([scores, trigram_scores])
+        return _best_scores(ids, scores)
+
+
+class ProcedureSearchIndex(_NameIndex):
+    """Autocomplete index over distinct (procedure_name, billing_code) pairs.
+
+    Billing codes are posted by their normalized form for prefix lookups;
+    procedure names are indexed by word (for word-prefix matches) and by
+    character trigram (for substring and typo-tolerant matches). Queries
+    never touch the underlying plan rows.
+
+    An index built from `entries` dicts keeps their names and codes in the
+    `entries` table and the plans each is priced in as offsets into `plans`,
+    and `search` returns them as dicts again. The procedure dimension instead
+    grows one with `extend`, keyed by procedure_id, and looks the ids ranked
+    by `rank` up in its own table.
+    """
+
+    def __init__(self, entries: Iterable[Dict] = ()):
+        super().__init__()
+        self.entries = pd.DataFrame({'procedure_name': pd.Series(dtype='str'), 'billing_code': pd.Series(dtype='str')})
+        self.plans: List[str] = []
+        self._plan_offsets = np.zeros(1, dtype='int64')
+        self._plan_ids = _NO_IDS
+        self._codes = np.empty(0, dtype='S1')
+        self._code_postings = Postings()
+
+        unique = {}
+        for entry in entries:
+            unique.setdefault((entry['procedure_name'], entry['billing_code']), entry.get('plans', []))
+        if not unique:
+            return
+        names, codes = [name for name, _ in unique], [code for _, code in unique]
+        self.entries = pd.DataFrame({'procedure_name': names, 'billing_code': codes})
+        self.plans = sorted(set().union(*unique.values()))
+        plan_ids = {plan: i for i, plan in enumerate(self.plans)}
+        self._plan_offsets = np.concatenate([[0], np.cumsum([len(plans) for plans in unique.values()])]).astype('int64')
+        self._plan_ids = np.array([plan_ids[plan] for plans in unique.values() for plan in plans], dtype='int32')
+        self._append_procedures(names, codes)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], entries: Optional[pd.DataFrame] = None,
+                    plans: Iterable[str] = ()) -> 'ProcedureSearchIndex':
+        """An index over another index's arrays() and, if it was built from entries, its entries table and plans"""
+        index = super().from_arrays(arrays)
+        if entries is not None:
+            index.entries = entries
+        index.plans = list(plans)
+        return index
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            **super().arrays(), 'codes': self._codes, 'plan_offsets': self._plan_offsets, 'plan_ids': self._plan_ids,
+            **with_prefix('code_postings', self._code_postings.arrays()),
+        }
+
+    def _set_arrays(self, arrays: Dict[str, np.ndarray]):
+        super()._set_arrays(arrays)
+        self._codes = arrays['codes']
+        self._plan_offsets = arrays['plan_offsets']
+        self._plan_ids = arrays['plan_ids']
+        self._code_postings = Postings.from_arrays(under_prefix('code_postings', arrays))
+
+    def extend(self, names: Iterable, codes: Iterable) -> 'ProcedureSearchIndex':
+        """A copy of the index with the next procedures added, ids continuing from len(self)"""
+        index = copy.copy(self)
+        index._append_procedures(list(names), list(codes))
+        return index
+
+    def _append_procedures(self, names: List, codes: List):
+        first_id = len(self)
+        self._append([name] for name in names)
+        codes = [normalize_text(code).replace(' ', '') for code in codes]
+        self._codes = np.concatenate([self._codes, np.array(codes, dtype='S')]) if codes else self._codes
+        posted = [(code, entry_id) for entry_id, code in enumerate(codes, first_id) if code]
+        self._code_postings = self._code_postings.merged([code for code, _ in posted], [i for _, i in posted])
+
+    def _entry_bytes(self) -> int:
+        entries = int(self.entries.memory_usage(index=True, deep=True).sum())
+        plans = self._plan_offsets.nbytes + self._plan_ids.nbytes
+        return entries + plans + self._codes.nbytes + self._code_postings.memory_usage()
+
+    def _code_matches(self, term: str, entry_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        code = term.replace(' ', '')
+        prefixed = _restrict(self._code_postings.union(*self._code_postings.prefix_range(code)), entry_ids)
+        exact = _restrict(self._code_postings.get(code), entry_ids)
+        return (np.concatenate([prefixed, exact]),
+                np.repeat([SCORE_CODE_PREFIX, SCORE_EXACT_CODE], [len(prefixed), len(exact)]))
+
+    def rank(self, term: str, limit: int = DEFAULT_LIMIT, procedure_ids: Optional[np.ndarray] = None) -> List[int]:
+        """Ids of up to `limit` entries matching term, best matches first, optionally among procedure_ids only"""
+        term = normalize_text(term)
+        if not term or not len(self):
+            return []
+
+        # Only the given procedures are scored
+        name_ids, name_scores = self._name_scores(term, entry_ids=procedure_ids)
+        code_ids, code_scores = self._code_matches(term, procedure_ids)
+        ids, scores = _best_scores(np.concatenate([name_ids, code_ids]), np.concatenate([name_scores, code_scores]))
+        return self._ranked(ids, scores, limit, tiebreak=self._codes)
+
+    def search(self, term: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+        """Return up to `limit` entries matching term, best matches first"""
+        ranked = self.rank(term, limit)
+        rows = self.entries.take(ranked)
+        return [
+            {"procedure_name": name, "billing_code": code, "plans": self._plans_of(entry_id)}
+            for entry_id, name, code in zip(ranked, rows['procedure_name'], rows['billing_code'])
+        ]
+
+    def _plans_of(self, entry_id: int) -> List[str]:
+        start, stop = self._plan_offsets[entry_id], self._plan_offsets[entry_id + 1]
+        return [self.plans[plan_id] for plan_id in self._plan_ids[start:stop].tolist()]
+
+
+class ProviderSearchIndex(_NameIndex):
+    """Name index over providers, keyed by provider id (position in the provider dimension).
+
+    Both the legal business name and the other organization name are indexed,
+    since the other name is usually the one patients know. Provider details
+    are not copied here; callers look ranked ids up in the dimension.
+    """
+
+    def extend(self, legal_names: Iterable, other_names: Iterable) -> 'ProviderSearchIndex':
+        """A copy of the index with the next providers' names added, ids continuing from len(self)"""
+        # The other name ranks first: it is what users type
+        return self._extended(
+            [other_name if isinstance(other_name, str) else None, legal_name if isinstance(legal_name, str) else None]
+            for legal_name, other_name in zip(legal_names, other_names)
+        )
+
+    def match(self, term: str) -> np.ndarray:
+        """Sorted provider ids whose names contain the term or start words with its tokens"""
+        term = normalize_text(term)
+        if not term:
+            return _NO_IDS
+        return self._name_scores(term, fuzzy=False)[0].astype('int32')
+
+    def search(self, term: str, limit: int = DEFAULT_LIMIT, provider_ids: Optional[np.ndarray] = None) -> List[int]:
+        """Ranked provider ids for a name search, optionally restricted to a set of provider ids"""
+        term = normalize_text(term)
+        if not term:
+            return []
+
+        return self._ranked(*self._name_scores(term, entry_ids=provider_ids), limit)
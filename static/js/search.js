@@ -34,6 +34,36 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    const providerInput = document.getElementById('provider');
+    const providerList = document.getElementById('providerList');
+    let providerTimeoutId;
+
+    providerInput.addEventListener('input', function() {
+        clearTimeout(providerTimeoutId);
+        const searchTerm = this.value;
+        
+        if (searchTerm.length < 2) {
+            providerList.innerHTML = '';
+            return;
+        }
+
+        providerTimeoutId = setTimeout(async () => {
+            const response = await fetch(`/api/providers?plan=${insuranceSelect.value}&term=${encodeURIComponent(searchTerm)}`);
+            const providers = await response.json();
+            
+            providerList.innerHTML = providers.map(prov => `
+                <button type="button" class="list-group-item list-group-item-action">${prov.other_name || prov.legal_name}</button>
+            `).join('');
+        }, 300);
+    });
+
+    providerList.addEventListener('click', function(e) {
+        if (e.target.matches('button')) {
+            providerInput.value = e.target.textContent.trim();
+            providerList.innerHTML = '';
+        }
+    });
+
     // Validate ZIP code
     const zipcodeInput = document.getElementById('zipcode');
     zipcodeInput.addEventListener('input', function() {
@@ -13,21 +13,12 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         timeoutId = setTimeout(async () => {
-            const insurancePlans = ['Aetna_PPO', 'BCBS_Essentials', 'Cigna_OAP', 'UHC_Options_PPO'];
-            let allProcedures = new Set();
-
-            // Fetch procedures from all insurance plans
-            for (const plan of insurancePlans) {
-                const response = await fetch(`/api/procedures?plan=${plan}&term=${searchTerm}`);
-                const procedures = await response.json();
-                procedures.forEach(proc => allProcedures.add(JSON.stringify(proc)));
-            }
-
-            // Convert back to array and remove duplicates
-            const uniqueProcedures = Array.from(allProcedures).map(proc => JSON.parse(proc));
+            // One request covers every loaded plan; the server dedupes across plans
+            const response = await fetch(`/api/procedures?plan=all&term=${encodeURIComponent(searchTerm)}`);
+            const procedures = await response.json();
             
-            procedureList.innerHTML = uniqueProcedures.map(proc => `
-                <button type="button" class="list-group-item list-group-item-action">
+            procedureList.innerHTML = procedures.map(proc => `
+                <button type="button" class="list-group-item list-group-item-action" title="${proc.plans.join(', ')}">
                     ${proc.billing_code} - ${proc.procedure_name}
                 </button>
             `).join('');
@@ -0,0 +1,141 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from plan_index import normalize_billing_code
+from search_index import Postings, encode_keys, find_key, under_prefix, with_prefix
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_STAT_COLUMNS = [
+    'count', 'min', 'Q1', 'median', 'Q3', 'max', 'range', 'IQR',
+    'mean', 'std', '10th_percentile', '90th_percentile',
+]
+
+# Percentiles matching the summary files' Q1/median/Q3/10th/90th columns
+PERCENTILES = [10, 25, 50, 75, 90]
+
+
+def compute_stats(rates: np.ndarray) -> Dict[str, Optional[float]]:
+    """The summary-file statistics for an array of rates (linear quantiles, sample std)"""
+    rates = np.asarray(rates, dtype='float64')
+    rates = rates[~np.isnan(rates)]
+    if len(rates) == 0:
+        return {**{column: None for column in SUMMARY_STAT_COLUMNS}, 'count': 0}
+    p10, q1, median, q3, p90 = np.percentile(rates, PERCENTILES)
+    low, high = rates.min(), rates.max()
+    stats = {
+        'count': len(rates),
+        'min': low,
+        'Q1': q1,
+        'median': median,
+        'Q3': q3,
+        'max': high,
+        'range': high - low,
+        'IQR': q3 - q1,
+        'mean': rates.mean(),
+        'std': rates.std(ddof=1) if len(rates) > 1 else np.nan,
+        '10th_percentile': p10,
+        '90th_percentile': p90,
+    }
+    return {column: _round(value) for column, value in stats.items()}
+
+
+def _round(value) -> Optional[float]:
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+class StatsIndex:
+    """Precomputed summary statistics for every plan in one table.
+
+    Rows are ordered by procedure name, so all plans' rows for a procedure
+    form one contiguous block: `procedure_offsets[i]` is the (start, stop) of
+    `procedure_names[i]` (sorted, UTF-8). Billing codes are posted to row
+    positions in `code_positions` as a fallback. `from_arrays` puts an index
+    back together from its table and `arrays()` without regrouping the table.
+    """
+
+    def __init__(self, summaries: List[Tuple[str, pd.DataFrame]]):
+        frames = [
+            df[['procedure_name', 'billing_code'] + [c for c in SUMMARY_STAT_COLUMNS if c in df.columns]]
+            .dropna(subset=['procedure_name'])
+            .assign(plan=plan)
+            for plan, df in summaries
+        ]
+        columns = ['plan', 'procedure_name', 'billing_code'] + SUMMARY_STAT_COLUMNS
+        if frames:
+            table = pd.concat(frames, ignore_index=True).reindex(columns=columns)
+            table['billing_code'] = table['billing_code'].map(normalize_billing_code)
+            table = table.sort_values(['procedure_name', 'plan'], kind='stable').reset_index(drop=True)
+        else:
+            table = pd.DataFrame(columns=columns)
+        self.table = table
+        self.plans = sorted({plan for plan, _ in summaries})
+
+        names, starts, counts = np.unique(encode_keys(table['procedure_name']), return_index=True, return_counts=True)
+        codes = encode_keys(table['billing_code'])
+        self._set_arrays({
+            'procedure_names': names,
+            'procedure_offsets': np.column_stack([starts, starts + counts]).astype('int64'),
+            **with_prefix('code_positions', Postings.from_pairs(codes, np.arange(len(table))).arrays()),
+        })
+        logger.info(f"Indexed summary statistics for {len(self.procedure_names)} procedures across {len(self.plans)} plans")
+
+    @classmethod
+    def from_arrays(cls, table: pd.DataFrame, plans: List[str], arrays: Dict[str, np.ndarray]) -> 'StatsIndex':
+        """An index over another index's table, plans and arrays(), e.g. read-only views from shared memory"""
+        stats_index = cls.__new__(cls)
+        stats_index.table = table
+        stats_index.plans = list(plans)
+        stats_index._set_arrays(arrays)
+        return stats_index
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'procedure_names': self.procedure_names, 'procedure_offsets': self.procedure_offsets,
+            **with_prefix('code_positions', self.code_positions.arrays()),
+        }
+
+    def _set_arrays(self, arrays: Dict[str, np.ndarray]):
+        self.procedure_names = arrays['procedure_names']
+        self.procedure_offsets = arrays['procedure_offsets']
+        self.code_positions = Postings.from_arrays(under_prefix('code_positions', arrays))
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def lookup(self, procedure: str) -> Dict[str, Dict]:
+        """Stats per plan for a procedure name, falling back to a billing code"""
+        position = find_key(self.procedure_names, procedure)
+        if position >= 0:
+            start, stop = self.procedure_offsets[position].tolist()
+            rows = self.table.iloc[start:stop]
+        else:
+            positions = self.code_positions.get(normalize_billing_code(procedure))
+            if not len(positions):
+                return {}
+            rows = self.table.take(positions)
+
+        result = {}
+        for record in rows.to_dict('records'):
+            # A code shared by several names keeps the first (alphabetical) name per plan
+            plan = record.pop('plan')
+            if plan not in result:
+                stats = {column: _clean(value) for column, value in record.items()}
+                if stats['count'] is not None:
+                    stats['count'] = int(stats['count'])
+                result[plan] = stats
+        return result
+
+
+def _clean(value):
+    """NaN -> None and numpy scalars -> Python, so results serialize as JSON"""
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
@@ -0,0 +1,162 @@
+"""Generate synthetic plan data and summary files in the Austin_* schema.
+
+Usage:
+    python synthetic_data.py OUT_DIR [--rows 100000] [--plans 3] [--procedures 1000]
+                             [--providers 2000] [--zipf 1.1] [--seed 0]
+
+Rows are split evenly across plans and written in chunks, so 10^7 rows need
+no more memory than one chunk plus the per-plan rate array kept for the
+summary. Procedure popularity follows a Zipf distribution (a few procedures
+account for most rows, as in real MRF extracts), providers are placed at
+Austin-area ZIP centroids so distance filters have work to do, and rates are
+log-normal around a per-procedure base price.
+"""
+import argparse
+import logging
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from dimensions import PROVIDER_COLUMNS
+from geo import ZipCentroids
+from stats_index import SUMMARY_STAT_COLUMNS, compute_stats
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 500_000
+
+DATA_COLUMNS = ['procedure_name', 'negotiated_rate', 'npi', 'billing_code', 'NPI'] + PROVIDER_COLUMNS
+
+WORDS = [
+    'Excision', 'Removal', 'Injection', 'Repair', 'Imaging', 'Biopsy', 'Therapy', 'Evaluation',
+    'Lesion', 'Skin', 'Knee', 'Spine', 'Heart', 'Blood', 'Vein', 'Nerve', 'Joint', 'Thyroid',
+    'Emergency', 'Office', 'Visit', 'Test', 'Screening', 'Radiologic', 'Laser', 'Debridement',
+]
+ORG_WORDS = ['Austin', 'Capital', 'Central', 'Texas', 'Hill', 'Country', 'Lakeside', 'Family', 'Surgical',
+             'Medical', 'Health', 'Care', 'Imaging', 'Pediatrics', 'Orthopedic', 'Vascular']
+ORG_SUFFIXES = ['CLINIC PA', 'ASSOCIATES LLP', 'HEALTH SYSTEM', 'SURGERY CENTER LLC', 'MEDICAL GROUP PLLC']
+STREETS = ['CONGRESS AVE', 'LAMAR BLVD', 'BURNET RD', 'RIVERSIDE DR', 'OLTORF ST', 'MOPAC EXPY', 'PARMER LN']
+
+
+def zipf_weights(count: int, exponent: float) -> np.ndarray:
+    """Probabilities of ranks 1..count under a Zipf law"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def make_procedures(count: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Distinct procedure names with 5-digit billing codes and base prices"""
+    codes = 10000 + rng.choice(90000, size=count, replace=False)
+    names = [
+        f"{' '.join(rng.choice(WORDS, size=3, replace=False))} procedure {i}"
+        for i in range(count)
+    ]
+    return pd.DataFrame({
+        'procedure_name': names,
+        'billing_code': codes,
+        'base_price': np.round(np.exp(rng.uniform(np.log(20), np.log(5000), size=count)), 2),
+    })
+
+
+def make_providers(count: int, rng: np.random.Generator, zip_centroids: ZipCentroids) -> pd.DataFrame:
+    """Provider records with unique NPIs, located in Austin-area ZIP codes"""
+    zips = [zipcode for zipcode in zip_centroids.table.index if zipcode.startswith('787')] or ['78701']
+    npis = 1_000_000_000 + rng.choice(1_000_000_000, size=count, replace=False)
+    legal = [
+        f"{' '.join(rng.choice(ORG_WORDS, size=2, replace=False)).upper()} {rng.choice(ORG_SUFFIXES)}"
+        for _ in range(count)
+    ]
+    return pd.DataFrame({
+        'npi': npis,
+        PROVIDER_COLUMNS[0]: legal,
+        PROVIDER_COLUMNS[1]: [name.rsplit(' ', 1)[0] if rng.random() < 0.6 else '' for name in legal],
+        PROVIDER_COLUMNS[2]: [f"{rng.integers(100, 9999)} {rng.choice(STREETS)}" for _ in range(count)],
+        PROVIDER_COLUMNS[3]: [f"SUITE {rng.integers(100, 999)}" if rng.random() < 0.4 else '' for _ in range(count)],
+        PROVIDER_COLUMNS[4]: 'AUSTIN',
+        PROVIDER_COLUMNS[5]: 'TX',
+        PROVIDER_COLUMNS[6]: rng.choice(zips, size=count),
+        PROVIDER_COLUMNS[7]: rng.integers(5_120_000_000, 5_129_999_999, size=count).astype('float64'),
+        'price_factor': np.exp(rng.normal(0, 0.35, size=count)),
+    })
+
+
+def write_plan(out_dir: str, plan: str, rows: int, procedures: pd.DataFrame, providers: pd.DataFrame,
+               procedure_weights: np.ndarray, rng: np.random.Generator) -> Dict[str, str]:
+    """Write one plan's data CSV in chunks and its summary CSV; returns both paths"""
+    data_path = os.path.join(out_dir, f"Austin_{plan}_data.csv")
+    procedure_ids, rates = [], []
+    for start in range(0, rows, CHUNK_ROWS):
+        size = min(CHUNK_ROWS, rows - start)
+        proc = rng.choice(len(procedures), size=size, p=procedure_weights)
+        prov = rng.integers(0, len(providers), size=size)
+        rate = procedures['base_price'].to_numpy()[proc] * providers['price_factor'].to_numpy()[prov]
+        rate = np.round(rate * np.exp(rng.normal(0, 0.25, size=size)), 2)
+
+        chunk = providers.iloc[prov].drop(columns='price_factor').reset_index(drop=True)
+        chunk['NPI'] = chunk['npi']
+        chunk['procedure_name'] = procedures['procedure_name'].to_numpy()[proc]
+        chunk['billing_code'] = procedures['billing_code'].to_numpy()[proc]
+        chunk['negotiated_rate'] = rate
+        chunk[DATA_COLUMNS].to_csv(data_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+        procedure_ids.append(proc.astype('int32'))
+        rates.append(rate)
+
+    summary_path = os.path.join(out_dir, f"summary_Austin_{plan}.csv")
+    summarize(np.concatenate(procedure_ids), np.concatenate(rates), procedures).to_csv(summary_path, index=False)
+    logger.info(f"Wrote {data_path} ({rows} rows) and {summary_path}")
+    return {'data': data_path, 'summary': summary_path}
+
+
+def summarize(procedure_ids: np.ndarray, rates: np.ndarray, procedures: pd.DataFrame) -> pd.DataFrame:
+    """Summary-file rows computed the same way as stats_index.compute_stats"""
+    order = np.argsort(procedure_ids, kind='stable')
+    procedure_ids, rates = procedure_ids[order], rates[order]
+    present, starts = np.unique(procedure_ids, return_index=True)
+    stops = np.append(starts[1:], len(procedure_ids))
+    records = [
+        {'billing_code': procedures['billing_code'].iat[i], 'procedure_name': procedures['procedure_name'].iat[i],
+         **compute_stats(rates[start:stop])}
+        for i, start, stop in zip(present, starts, stops)
+    ]
+    return pd.DataFrame(records, columns=['billing_code', 'procedure_name'] + SUMMARY_STAT_COLUMNS)
+
+
+def generate(out_dir: str, rows: int = 100_000, plans: int = 3, procedures: int = 1000, providers: int = 2000,
+             zipf: float = 1.1, seed: int = 0) -> List[Dict[str, str]]:
+    """Generate `plans` plans sharing one procedure and provider universe, `rows` rows in total"""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    procedure_table = make_procedures(procedures, rng)
+    provider_table = make_providers(providers, rng, ZipCentroids.load())
+    weights = zipf_weights(procedures, zipf)
+
+    written = []
+    for k in range(plans):
+        plan_rows = rows // plans + (1 if k < rows % plans else 0)
+        # Each plan ranks procedures differently, like real payers' volumes
+        plan_weights = weights[rng.permutation(procedures)]
+        written.append(write_plan(out_dir, f"Synthetic{k + 1}_PPO", plan_rows, procedure_table, provider_table,
+                                  plan_weights, rng))
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Austin_* plan data and summary files")
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=int, default=100_000, help="Total rows across all plans")
+    parser.add_argument('--plans', type=int, default=3)
+    parser.add_argument('--procedures', type=int, default=1000)
+    parser.add_argument('--providers', type=int, default=2000)
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of procedure popularity")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    generate(args.out_dir, rows=args.rows, plans=args.plans, procedures=args.procedures,
+             providers=args.providers, zipf=args.zipf, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
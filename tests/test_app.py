@@ -0,0 +1,184 @@
+import io
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+SEARCH = '/api/search_results?plan=Aetna_PPO&procedure=MRI&zipcode=78701'
+
+
+@pytest.mark.parametrize('query', ['min_price=abc', 'max_price=12..5', 'min_price=nan', 'distance=abc', 'distance=1.5',
+                                   'distance=-5'])
+def test_invalid_search_filters_are_a_400(client, query):
+    response = client.get(f"{SEARCH}&{query}")
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Invalid filter')
+    assert response.get_json()['results'] == []
+
+
+def test_invalid_filters_on_the_page_and_export_are_a_400(client):
+    assert client.get('/search_results?plan=Aetna_PPO&procedure=MRI&min_price=abc').status_code == 400
+    assert client.get('/export_results?plan=Aetna_PPO&procedure=MRI&distance=abc').status_code == 400
+
+
+def post_batch(client, body):
+    return client.post('/api/batch_quotes', data=body, content_type='application/json')
+
+
+@pytest.mark.parametrize('body', [
+    '{"procedures": ["MRI"], "zipcode": "78701", "distance": 1e400}',
+    '{"procedures": ["MRI"], "rows": 1e400}',
+    '{"procedures": ["MRI"], "zipcode": "78701", "distance": -5}',
+    '{"procedures": [{"a": 1}]}',
+    '{"procedures": ["MRI", ["73721"]]}',
+    '{"procedures": [true]}',
+    '{"procedures": [null]}',
+])
+def test_invalid_batch_quotes_are_a_400(client, body):
+    response = post_batch(client, body)
+    assert response.status_code == 400
+    assert response.get_json()['items'] == []
+
+
+def test_batch_quotes_accept_numeric_codes(client):
+    response = post_batch(client, '{"procedures": [99284, "Test to determine heart abnormalities"], "plans": ["Aetna_PPO"]}')
+    assert response.status_code == 200
+    items = response.get_json()['items']
+    assert [item['procedure'] for item in items] == ['99284', 'Test to determine heart abnormalities']
+    assert [item['count'] for item in items] == [436, 121]
+
+
+def test_cached_json_body_and_etag_come_from_one_dataset(monkeypatch):
+    import app as app_module
+
+    old = SimpleNamespace(version='old-version', label='old')
+    new = SimpleNamespace(version='new-version', label='new')
+    monkeypatch.setattr(app_module.data_processor, 'dataset', old)
+
+    def compute(dataset):
+        # A reload swaps the dataset while this request is computing
+        app_module.data_processor.dataset = new
+        return {'label': dataset.label}
+
+    with app.test_request_context('/api/procedures?term=mri'):
+        response = app_module._cached_json('test:reload-mid-request', compute)
+    assert response.get_json() == {'label': 'old'}
+    assert response.get_etag()[0].startswith('old-version-')
+
+
+def test_reload_keeps_the_old_dataset_usable_and_changes_etags(client, monkeypatch, tmp_path):
+    import app as app_module
+    from data_processor import DataProcessor
+
+    plan = tmp_path / 'Austin_Aetna_PPO_data.csv'
+    plan.write_text('procedure_name,billing_code,negotiated_rate,npi\nMRI KNEE,73721,410.0,1111111111\n')
+    processor = DataProcessor(str(tmp_path), reload_interval=0)
+    processor.reload_listeners.append(lambda dataset: app_module.response_cache.cache.clear())
+    monkeypatch.setattr(app_module, 'data_processor', processor)
+
+    url = '/api/procedures?plan=Aetna_PPO&term=mri'
+    before = client.get(url)
+    old = processor.dataset
+    assert before.get_etag()[0].startswith(f"{old.version}-")
+
+    plan.write_text('procedure_name,billing_code,negotiated_rate,npi\nMRI KNEE,73721,410.0,1111111111\n'
+                    'MRI KNEE,73721,395.5,2222222222\nMRI HEART,75557,900.0,1111111111\n')
+    assert processor.reload()
+    new = processor.dataset
+    assert new is not old and new.version != old.version
+
+    # A request that took the old dataset before the swap still gets that version's answers
+    assert [entry['procedure_name'] for entry in processor.search_procedures('Aetna_PPO', '', 'mri', dataset=old)] == ['MRI KNEE']
+    assert processor.get_stats_data('MRI KNEE', dataset=old)['Aetna_PPO']['count'] == 1
+    assert processor.get_stats_data('MRI KNEE')['Aetna_PPO']['count'] == 2
+
+    # Both versions are cached under their own keys
+    key = processor._get_cache_key('stats_data', 'MRI KNEE', None, None, None, None, None)
+    assert f"{old.version}:{key}" in processor.cache and f"{new.version}:{key}" in processor.cache
+
+    # The new version's response has a new ETag, so the old one no longer revalidates
+    after = client.get(url, headers={'If-None-Match': before.get_etag()[0]})
+    assert after.status_code == 200
+    assert after.get_etag()[0].startswith(f"{new.version}-")
+    assert [entry['procedure_name'] for entry in after.get_json()] == ['MRI KNEE', 'MRI HEART']
+    assert client.get(url, headers={'If-None-Match': after.get_etag()[0]}).status_code == 304
+
+
+def test_batch_quotes_skip_rows_without_a_rate(client, monkeypatch, tmp_path):
+    import json
+
+    import app as app_module
+    from data_processor import DataProcessor
+
+    (tmp_path / 'Austin_Aetna_PPO_data.csv').write_text(
+        'procedure_name,billing_code,negotiated_rate,npi\n'
+        'MRI KNEE,73721,410.0,1111111111\nMRI KNEE,73721,,2222222222\nXRAY KNEE,73560,,1111111111\n'
+    )
+    monkeypatch.setattr(app_module, 'data_processor', DataProcessor(str(tmp_path), reload_interval=0))
+
+    response = post_batch(client, '{"procedures": ["MRI KNEE", "XRAY KNEE"], "rows": 5}')
+    assert response.status_code == 200
+
+    def reject(constant):
+        raise ValueError(f"invalid JSON constant {constant}")
+
+    # Strict JSON, as browsers parse it: no bare NaN
+    items = json.loads(response.get_data(as_text=True), parse_constant=reject)['items']
+    mri, xray = items
+    assert (mri['count'], mri['min'], mri['max']) == (1, 410.0, 410.0)
+    assert [row['negotiated_rate'] for row in mri['rows']] == [410.0]
+    assert xray == {'plan': 'Aetna_PPO', 'procedure': 'XRAY KNEE', 'count': 0, 'min': None, 'median': None,
+                    'max': None, 'cheapest': None, 'rows': []}
+
+
+def write_all_plans_data(directory):
+    """Aetna with data and summary files, Cigna with only data, UHC with only a summary"""
+    from ingest import _summarize
+
+    aetna = ('procedure_name,billing_code,negotiated_rate,npi\n'
+             'MRI KNEE,73721,410.0,1111111111\nMRI KNEE,73721,395.5,2222222222\nXRAY KNEE,73560,80.0,1111111111\n')
+    (directory / 'Austin_Aetna_PPO_data.csv').write_text(aetna)
+    (directory / 'Austin_Cigna_HMO_data.csv').write_text(
+        'procedure_name,billing_code,negotiated_rate,npi\nMRI KNEE,73721,455.0,3333333333\n'
+    )
+    _summarize(pd.read_csv(io.StringIO(aetna), dtype={'billing_code': 'str'})).to_csv(
+        directory / 'summary_Austin_Aetna_PPO.csv', index=False)
+    (directory / 'summary_Austin_UHC_Options_PPO.csv').write_text(
+        'billing_code,procedure_name,count,min,median,max\n73721.0,MRI KNEE,3,300.0,350.0,400.0\n'
+        '20610,KNEE INJECTION,2,90.0,95.0,100.0\n'
+    )
+
+
+def test_all_plans_autocomplete_lists_each_procedure_once_with_its_plans(client, monkeypatch, tmp_path):
+    import app as app_module
+    from data_processor import DataProcessor
+
+    write_all_plans_data(tmp_path)
+    processor = DataProcessor(str(tmp_path), reload_interval=0)
+    monkeypatch.setattr(app_module, 'data_processor', processor)
+
+    url = '/api/procedures?plan=all&term=knee'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.get_json() == [
+        {'procedure_name': 'KNEE INJECTION', 'billing_code': '20610', 'plans': ['UHC_Options_PPO']},
+        {'procedure_name': 'MRI KNEE', 'billing_code': '73721', 'plans': ['Aetna_PPO', 'Cigna_HMO', 'UHC_Options_PPO']},
+        {'procedure_name': 'XRAY KNEE', 'billing_code': '73560', 'plans': ['Aetna_PPO']},
+    ]
+    assert client.get('/api/procedures?plan=all&term=7372').get_json()[0]['plans'] == [
+        'Aetna_PPO', 'Cigna_HMO', 'UHC_Options_PPO']
+
+    # Cached under the dataset version, in the response cache and the result cache
+    version = processor.dataset.version
+    assert response.get_etag()[0].startswith(f"{version}-")
+    assert f"{version}:procedures:all:knee:25" in app_module.response_cache.cache
+    assert f"{version}:{processor._get_cache_key('procedures', 'all', 'knee', 25)}" in processor.cache
+    assert client.get(url, headers={'If-None-Match': response.get_etag()[0]}).status_code == 304
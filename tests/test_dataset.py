@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+
+from dataset import Dataset, data_filename, fingerprint
+
+
+def write_plan(directory, text='procedure_name,negotiated_rate\nMRI KNEE,410.0\n'):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'Austin_Aetna_PPO_data.csv')
+    with open(path, 'w') as f:
+        f.write(text)
+    return {'Austin_Aetna_PPO_data.csv': path}
+
+
+def test_fingerprint_depends_on_content_not_path_or_mtime(tmp_path):
+    first = write_plan(tmp_path / 'checkout-a')
+    second = write_plan(tmp_path / 'checkout-b')
+    os.utime(second['Austin_Aetna_PPO_data.csv'], (0, 0))
+    assert fingerprint(first) == fingerprint(second)
+
+    # Same size, different content
+    changed = write_plan(tmp_path / 'checkout-c', text='procedure_name,negotiated_rate\nMRI KNEE,999.0\n')
+    assert fingerprint(changed) != fingerprint(first)
+
+    # A rewrite in place is noticed even though the path is the same
+    version = fingerprint(first)
+    write_plan(tmp_path / 'checkout-a', text='procedure_name,negotiated_rate\nMRI KNEE,4110.0\n')
+    assert fingerprint(first) != version
+
+
+def test_fingerprint_uses_the_ingest_manifest_content_hash(tmp_path):
+    sources = write_plan(tmp_path / 'versions' / '20260101T000000Z-abcd1234')
+    with open(tmp_path / 'versions' / '20260101T000000Z-abcd1234' / 'manifest.json', 'w') as f:
+        json.dump({'version': '20260101T000000Z-abcd1234', 'content_hash': '0123456789abcdef0123'}, f)
+    assert fingerprint(sources) == '0123456789ab'
+
+    # A copy of the version elsewhere keeps its version
+    copy = shutil.copytree(tmp_path / 'versions', tmp_path / 'elsewhere')
+    assert fingerprint({name: os.path.join(copy, '20260101T000000Z-abcd1234', name) for name in sources}) == '0123456789ab'
+
+
+def write_plans(directory, plans):
+    """One data file per plan, every plan pricing the same procedure at the same providers"""
+    os.makedirs(directory, exist_ok=True)
+    sources = {}
+    for plan in plans:
+        path = os.path.join(directory, data_filename(plan))
+        with open(path, 'w') as f:
+            f.write('procedure_name,billing_code,negotiated_rate,npi\n'
+                    'MRI KNEE,73721,410.0,1111111111\nMRI KNEE,73721,395.5,2222222222\n')
+        sources[data_filename(plan)] = path
+    return sources
+
+
+def test_lazy_plans_are_evicted_least_recently_used_first(tmp_path):
+    sources = write_plans(tmp_path, ['Aetna_PPO', 'Cigna_HMO', 'United_EPO'])
+    aetna, cigna, united = sorted(sources)
+
+    # Measure one plan, then allow the shared dimensions and two plans like it
+    probe = Dataset(sources, None, lazy_load=True).load()
+    plan_bytes = probe.get_plan_index(aetna).memory_usage()
+    budget = probe.shared_memory_usage() + 2 * plan_bytes
+
+    dataset = Dataset(sources, None, lazy_load=True, memory_budget=budget).load()
+    assert dataset.loaded_plans() == []
+    first = dataset.get_plan_index(aetna)
+    dataset.get_plan_index(cigna)
+    # Using Aetna again makes Cigna the least recently used plan
+    assert dataset.get_plan_index(aetna) is first
+    dataset.get_plan_index(united)
+    assert [filename for filename, _ in dataset.loaded_plans()] == [aetna, united]
+
+    # Evicted plans load again on demand, pushing out the next least recently used
+    assert dataset.get_plan_index(cigna).lookup('73721')['negotiated_rate'].tolist() == [395.5, 410.0]
+    assert [filename for filename, _ in dataset.loaded_plans()] == [united, cigna]
+
+
+def test_the_plan_being_loaded_is_kept_even_over_budget(tmp_path):
+    sources = write_plans(tmp_path, ['Aetna_PPO', 'Cigna_HMO', 'United_EPO'])
+    dataset = Dataset(sources, None, lazy_load=True, memory_budget=1).load()
+    for filename in sorted(sources):
+        plan_index = dataset.get_plan_index(filename)
+        assert plan_index is not None and len(plan_index) == 2
+        assert [loaded for loaded, _ in dataset.loaded_plans()] == [filename]
+
+
+def test_all_plans_index_covers_summary_only_plans_without_loading_plans(tmp_path):
+    sources = write_plans(tmp_path, ['Aetna_PPO', 'Cigna_HMO'])
+    summary = tmp_path / 'summary_Austin_UHC_Options_PPO.csv'
+    summary.write_text('billing_code,procedure_name,count\n73721.0,MRI KNEE,3\n20610,KNEE INJECTION,2\n')
+    sources[summary.name] = str(summary)
+
+    lazy = Dataset(sources, None, lazy_load=True).load()
+    entries = lazy.get_all_procedures_search().search('knee')
+    assert lazy.loaded_plans() == []
+    assert entries == [
+        {'procedure_name': 'KNEE INJECTION', 'billing_code': '20610', 'plans': ['UHC_Options_PPO']},
+        {'procedure_name': 'MRI KNEE', 'billing_code': '73721', 'plans': ['Aetna_PPO', 'Cigna_HMO', 'UHC_Options_PPO']},
+    ]
+    assert Dataset(sources, None).load().get_all_procedures_search().search('knee') == entries
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dimensions import PROVIDER_COLUMNS, ProcedureDimension, ProviderDimension
+from geo import EARTH_RADIUS_MILES, GRID_CELL_DEGREES, GridIndex, haversine_miles
+from plan_index import PlanIndex
+
+
+def test_haversine_miles():
+    # One degree of latitude anywhere, and of longitude on the equator
+    one_degree = 2 * np.pi * EARTH_RADIUS_MILES / 360
+    assert haversine_miles(0.0, 0.0, np.array([1.0, 0.0]), np.array([0.0, 1.0])) == pytest.approx([one_degree] * 2)
+    # Austin to Dallas is about 182 miles
+    assert haversine_miles(30.2672, -97.7431, np.array([32.7767]), np.array([-96.7970]))[0] == pytest.approx(182, abs=2)
+    assert haversine_miles(30.0, -97.0, np.array([30.0]), np.array([-97.0]))[0] == 0
+    # Antipodes are half the circumference, without NaN from rounding past 1
+    assert haversine_miles(0.0, 0.0, np.array([0.0]), np.array([180.0]))[0] == pytest.approx(np.pi * EARTH_RADIUS_MILES)
+
+
+def test_grid_candidates_include_points_on_cell_edges():
+    edge = 30 * GRID_CELL_DEGREES
+    lats = np.array([edge, edge - 1e-9, edge, 31.0, np.nan])
+    lons = np.array([-97.5, -97.5, -97.5 + 1e-9, -97.5, -97.5])
+    grid = GridIndex(lats, lons)
+
+    # Just below the edge, the points on and above it are in the next cell but within the box
+    candidates = grid.candidates(edge - 1e-6, -97.5, 0.5, 0, len(lats))
+    assert sorted(candidates.tolist()) == [0, 1, 2]
+    # Restricting to a row range uses the sorted cell rows
+    assert sorted(grid.candidates(edge, -97.5, 0.5, 1, 3).tolist()) == [1, 2]
+    assert grid.candidates(edge, -97.5, 0.5, 3, 5).tolist() == []
+
+
+def plan_at(lats, lons):
+    """A one-procedure plan with one provider per row at the given coordinates"""
+    table = pd.DataFrame({'npi': np.arange(1, len(lats) + 1), **{column: None for column in PROVIDER_COLUMNS}})
+    providers = ProviderDimension.from_table(table, lats, lons)
+    procedures = ProcedureDimension.from_table(pd.DataFrame({'procedure_name': ['MRI KNEE'], 'billing_code': ['73721']}))
+    facts = pd.DataFrame({
+        'procedure_id': np.zeros(len(lats), dtype='int32'),
+        'provider_id': np.arange(len(lats), dtype='int32'),
+        'negotiated_rate': np.arange(len(lats), dtype='float32'),
+    })
+    return PlanIndex.from_facts(facts, providers, procedures)
+
+
+@pytest.mark.parametrize('radius', [1, 10, 25, 60, 500])
+def test_radius_search_matches_brute_force(radius):
+    rng = np.random.default_rng(radius)
+    lats = rng.uniform(29.5, 31.0, 2000)
+    lons = rng.uniform(-98.5, -97.0, 2000)
+    lats[::50] = np.nan
+    plan_index = plan_at(lats, lons)
+    origin = (30.2672, -97.7431)
+
+    distances = haversine_miles(origin[0], origin[1], lats, lons)
+    for positions in (np.arange(2000), np.arange(100, 1900, 3)):
+        expected = positions[distances[positions] <= radius]
+        found, found_distances = plan_index.positions_near(origin, radius, positions)
+        assert found.tolist() == expected.tolist()
+        assert found_distances == pytest.approx(distances[expected])
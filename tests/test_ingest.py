@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from dataset import fingerprint
+from ingest import discover_sources, ingest_raw, read_manifest, resolve_dataset_dir
+
+
+def write_raw_plan(path):
+    path.write_text(
+        'procedure_name,negotiated_rate,npi,billing_code\n'
+        'MRI KNEE,410.0,1111111111,73721\n'
+        'XRAY KNEE,80.0,2222222222,73560\n'
+        'MRI KNEE,395.5,2222222222,73721\n'
+    )
+    return path
+
+
+def test_ingesting_the_same_data_twice_gives_the_same_version(tmp_path):
+    raw = write_raw_plan(tmp_path / 'Austin_Aetna_PPO_data.csv')
+    versions = []
+    for name in ('host-a', 'host-b'):
+        data_dir = tmp_path / name
+        data_dir.mkdir()
+        ingest_raw([str(raw)], str(data_dir), workers=1)
+        dataset_dir = resolve_dataset_dir(str(data_dir))
+        assert read_manifest(dataset_dir)['content_hash']
+        versions.append(fingerprint(discover_sources(dataset_dir)))
+
+    assert versions[0] == versions[1]
+
+
+def test_old_versions_are_pruned(tmp_path):
+    raw = write_raw_plan(tmp_path / 'Austin_Aetna_PPO_data.csv')
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    published = [ingest_raw([str(raw)], str(data_dir), workers=1) for _ in range(4)]
+    # An ingest still being built by another process is not touched
+    (data_dir / 'versions' / 'next.building').mkdir()
+
+    ingest_raw([str(raw)], str(data_dir), workers=1, keep_versions=2)
+    remaining = sorted(entry.name for entry in (data_dir / 'versions').iterdir())
+    current = read_manifest(resolve_dataset_dir(str(data_dir)))['version']
+    assert remaining == sorted([published[2], published[3], current, 'next.building'])
@@ -0,0 +1,122 @@
+import pytest
+
+import metrics
+from app import app
+from data_processor import DataProcessor
+from metrics import Counter, Gauge, Histogram, Registry
+
+DATA = 'procedure_name,billing_code,negotiated_rate,npi\n'
+
+
+def test_histogram_renders_cumulative_buckets_sum_and_count():
+    registry = Registry()
+    histogram = Histogram('test_seconds', "Test latency", ['endpoint'], buckets=(1, 0.1), registry=registry)
+    for value in [0.0625, 0.5, 4]:
+        histogram.observe(value, endpoint='/api/search')
+    histogram.observe(0.1, endpoint='/')
+
+    assert registry.render().splitlines() == [
+        '# HELP healthcare_test_seconds Test latency',
+        '# TYPE healthcare_test_seconds histogram',
+        # Bounds are inclusive, and label sets come out sorted
+        'healthcare_test_seconds_bucket{endpoint="/",le="0.1"} 1',
+        'healthcare_test_seconds_bucket{endpoint="/",le="1"} 1',
+        'healthcare_test_seconds_bucket{endpoint="/",le="+Inf"} 1',
+        'healthcare_test_seconds_sum{endpoint="/"} 0.1',
+        'healthcare_test_seconds_count{endpoint="/"} 1',
+        'healthcare_test_seconds_bucket{endpoint="/api/search",le="0.1"} 1',
+        'healthcare_test_seconds_bucket{endpoint="/api/search",le="1"} 2',
+        'healthcare_test_seconds_bucket{endpoint="/api/search",le="+Inf"} 3',
+        'healthcare_test_seconds_sum{endpoint="/api/search"} 4.5625',
+        'healthcare_test_seconds_count{endpoint="/api/search"} 3',
+    ]
+    with pytest.raises(TypeError):
+        histogram.set(1, endpoint='/')
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    gauge = Gauge('test_info', "Test labels", ['name'], registry=registry)
+    gauge.set(1, name='a "quoted" C:\\path\nnext line')
+    counter = Counter('test_total', "Test counter", registry=registry)
+    counter.inc()
+    counter.inc(2.5)
+
+    samples = registry.render().splitlines()
+    assert 'healthcare_test_info{name="a \\"quoted\\" C:\\\\path\\nnext line"} 1' in samples
+    assert 'healthcare_test_total 3.5' in samples
+
+
+def test_a_failing_collector_does_not_break_the_scrape():
+    registry = Registry()
+    gauge = Gauge('test_value', "Test gauge", registry=registry)
+    registry.on_collect(lambda: 1 / 0)
+    registry.on_collect(lambda: gauge.set(7))
+
+    assert 'healthcare_test_value 7' in registry.render().splitlines()
+
+
+def samples(metric) -> dict:
+    """A metric's current samples as {'name{labels}': 'value'}"""
+    return dict(line.rsplit(' ', 1) for line in metric.samples())
+
+
+def test_collectors_report_loaded_plans_and_cache_stats_at_scrape_time(tmp_path, monkeypatch):
+    (tmp_path / 'Austin_Aetna_PPO_data.csv').write_text(DATA + 'MRI KNEE,73721,410.0,1111111111\n'
+                                                               'XRAY KNEE,73560,80.0,1111111111\n')
+    (tmp_path / 'Austin_Cigna_HMO_data.csv').write_text(DATA + 'MRI KNEE,73721,455.0,3333333333\n')
+    processor = DataProcessor(str(tmp_path), lazy_load=True, reload_interval=0)
+    monkeypatch.setattr(metrics.REGISTRY, '_collectors', [processor.collect_metrics])
+
+    metrics.REGISTRY.render()
+    assert samples(metrics.PLAN_ROWS) == {}
+    assert samples(metrics.DATASET_INFO) == {f'healthcare_dataset_info{{version="{processor.dataset_version}"}}': '1'}
+
+    for _ in range(2):
+        processor.get_search_results('Aetna_PPO', procedure='MRI KNEE')
+    rendered = metrics.REGISTRY.render().splitlines()
+
+    # Only the plan loaded since the last scrape is reported
+    assert samples(metrics.PLAN_ROWS) == {'healthcare_plan_rows{plan="Aetna_PPO"}': '2'}
+    plan_memory = samples(metrics.PLAN_MEMORY_BYTES)
+    assert list(plan_memory) == ['healthcare_plan_memory_bytes{plan="Aetna_PPO"}']
+    assert int(plan_memory['healthcare_plan_memory_bytes{plan="Aetna_PPO"}']) > 0
+    assert {'providers', 'procedures'} == {
+        key.split('"')[1] for key in samples(metrics.DIMENSION_MEMORY_BYTES)
+    }
+    assert 'healthcare_cache_events_total{cache="results",event="hits"} 1' in rendered
+    assert 'healthcare_cache_events_total{cache="results",event="misses"} 1' in rendered
+    assert 'healthcare_cache_hit_ratio{cache="results"} 0.5' in rendered
+    assert 'healthcare_cache_entries{cache="results"} 1' in rendered
+
+
+def test_metrics_endpoint_serves_the_request_and_dataset_series():
+    client = app.test_client()
+    assert client.get('/api/procedures?plan=Aetna_PPO&q=mri').status_code == 200
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+    lines = response.get_data(as_text=True).splitlines()
+    for series in ['healthcare_http_requests_total', 'healthcare_http_request_seconds', 'healthcare_dataset_info',
+                   'healthcare_cache_hit_ratio', 'healthcare_dimension_memory_bytes']:
+        assert f'# TYPE {series} ' in '\n'.join(lines)
+    assert any(line.startswith('healthcare_http_requests_total{endpoint="/api/procedures",method="GET",status="200"} ')
+               for line in lines)
+    assert any(line.startswith('healthcare_http_request_seconds_count{endpoint="/api/procedures"} ') for line in lines)
+    assert any(line.startswith('healthcare_cache_entries{cache="responses"} ') for line in lines)
+
+
+def test_requests_over_the_slow_threshold_are_counted(monkeypatch):
+    import app as app_module
+    client = app.test_client()
+    key = 'healthcare_slow_requests_total{endpoint="/api/cache_stats"}'
+    before = float(samples(metrics.SLOW_REQUESTS).get(key, 0))
+
+    monkeypatch.setattr(app_module.profiler, 'slow_seconds', 60)
+    client.get('/api/cache_stats')
+    assert float(samples(metrics.SLOW_REQUESTS).get(key, 0)) == before
+
+    monkeypatch.setattr(app_module.profiler, 'slow_seconds', 0)
+    client.get('/api/cache_stats')
+    assert float(samples(metrics.SLOW_REQUESTS)[key]) == before + 1
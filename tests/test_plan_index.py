@@ -0,0 +1,122 @@
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dimensions import LEGAL_NAME_COLUMN, POSTAL_CODE_COLUMN, ProcedureDimension, ProviderDimension
+from geo import ZipCentroids
+from plan_index import PlanIndex, is_plan_sorted, sort_plan_frame
+
+
+def plan_frame(rows):
+    """Plan rows from (procedure_name, billing_code, negotiated_rate, npi) tuples"""
+    return pd.DataFrame({
+        'procedure_name': [name for name, _, _, _ in rows],
+        'billing_code': [code for _, code, _, _ in rows],
+        'negotiated_rate': [rate for _, _, rate, _ in rows],
+        'npi': [npi for _, _, _, npi in rows],
+        LEGAL_NAME_COLUMN: [f"PROVIDER {npi}" for _, _, _, npi in rows],
+        POSTAL_CODE_COLUMN: ['78701'] * len(rows),
+    })
+
+
+@pytest.fixture
+def zip_centroids():
+    return ZipCentroids(pd.DataFrame({'lat': [30.27], 'lon': [-97.74]}, index=pd.Index(['78701'], name='zip')))
+
+
+def test_memory_usage_includes_index_bytes(zip_centroids):
+    plan_index = PlanIndex(plan_frame([
+        ('MRI KNEE', '73721', 410.0, 1111111111),
+        ('MRI KNEE', '73721', 395.5, 2222222222),
+        ('XRAY KNEE', '73560', 80.0, 1111111111),
+    ]), ProviderDimension(zip_centroids), ProcedureDimension())
+
+    facts = int(plan_index.facts.memory_usage(index=True).sum())
+    indexed = plan_index.memory_usage()
+    lookups = plan_index.procedure_offsets.nbytes + plan_index.code_procedures.memory_usage()
+    assert indexed >= facts + lookups + plan_index.procedure_pairs().shape[0] * 4
+
+    # Structures built on first use are counted once they exist
+    plan_index.grid
+    assert plan_index.memory_usage() == indexed + plan_index.grid.memory_usage()
+    plan_index.provider_ids()
+    assert plan_index.memory_usage() == indexed + plan_index.grid.memory_usage() + plan_index.provider_ids().nbytes
+    assert plan_index.provider_ids().tolist() == [0, 1]
+
+
+def test_sorted_frames_with_missing_names_and_rates_are_not_sorted_again():
+    df = plan_frame([
+        ('XRAY KNEE', '73560', np.nan, 1111111111),
+        (None, '99999', 15.0, 1111111111),
+        ('MRI KNEE', '73721', 410.0, 1111111111),
+        ('XRAY KNEE', '73560', 80.0, 2222222222),
+        ('MRI KNEE', '73721', 395.5, 2222222222),
+    ])
+    assert not is_plan_sorted(df)
+
+    ordered = sort_plan_frame(df)
+    assert ordered['procedure_name'].tolist()[:4] == ['MRI KNEE', 'MRI KNEE', 'XRAY KNEE', 'XRAY KNEE']
+    assert ordered['negotiated_rate'].tolist()[:3] == [395.5, 410.0, 80.0]
+    # Rows without a name trail and a missing rate ends its procedure, which still counts as sorted
+    assert is_plan_sorted(ordered)
+    assert sort_plan_frame(ordered)['billing_code'].tolist() == ordered['billing_code'].tolist()
+
+    # A missing rate before a known one within a procedure, or a name after an unnamed row, is not
+    assert not is_plan_sorted(ordered.iloc[[0, 1, 3, 2, 4]])
+    assert not is_plan_sorted(ordered.iloc[[0, 1, 2, 4, 3]])
+
+
+@pytest.fixture
+def plan_index(zip_centroids):
+    return PlanIndex(plan_frame([
+        ('XRAY KNEE', '73560', 80.0, 1111111111),
+        ('MRI KNEE', '73721', 410.0, 1111111111),
+        (None, '99999', 15.0, 2222222222),
+        ('MRI KNEE', '73722', 19.99, 3333333333),
+        ('MRI KNEE', '73721', 395.5, 2222222222),
+        ('MRI KNEE WITH CONTRAST', '73721', 520.0, 1111111111),
+    ]), ProviderDimension(zip_centroids), ProcedureDimension())
+
+
+def test_procedure_offsets_cover_each_name_block(plan_index):
+    # Rows without a procedure name are dropped
+    assert len(plan_index) == 5
+    assert plan_index.procedure_names.tolist() == [b'MRI KNEE', b'MRI KNEE WITH CONTRAST', b'XRAY KNEE']
+    assert plan_index.procedure_offsets.tolist() == [[0, 3], [3, 4], [4, 5]]
+    assert plan_index.procedure_rows().to_dict() == {'MRI KNEE': 3, 'MRI KNEE WITH CONTRAST': 1, 'XRAY KNEE': 1}
+    assert plan_index.facts['negotiated_rate'].tolist()[:3] == pytest.approx([19.99, 395.5, 410.0])
+
+    # Names resolve first, then billing codes; unknown procedures are None
+    assert plan_index.lookup('XRAY KNEE')['negotiated_rate'].tolist() == [80.0]
+    assert plan_index.lookup('73560.0')['negotiated_rate'].tolist() == [80.0]
+    assert plan_index.lookup('99999') is None
+    assert plan_index.lookup('MRI') is None
+
+
+def test_code_shared_by_several_names_returns_only_its_rows(plan_index):
+    pairs = plan_index.procedures.table.take(plan_index.code_procedures.get('73721'))
+    assert pairs['procedure_name'].tolist() == ['MRI KNEE', 'MRI KNEE WITH CONTRAST']
+    assert plan_index._mixed_procedures.tolist() == [True, False, False]
+
+    # The MRI KNEE block also holds 73722, which must be masked out
+    rows = plan_index.rows_for_code('73721')
+    assert rows['negotiated_rate'].tolist() == [395.5, 410.0, 520.0]
+    assert plan_index.rows_for_code('73722')['negotiated_rate'].tolist() == pytest.approx([19.99])
+    assert plan_index.rows_for_code('73721', max_price=450)['negotiated_rate'].tolist() == [395.5, 410.0]
+
+    batch = plan_index.batch_rows(['73722', 'missing', 'XRAY KNEE'])
+    assert batch['item'].tolist() == [0, 2]
+
+
+def test_price_bounds_are_inclusive_at_float32_rates(plan_index):
+    # 19.99 is stored as float32 (19.9899997...), so comparing against the float64 bound would drop it
+    assert float(np.float32(19.99)) < 19.99
+    prices = lambda **bounds: plan_index.lookup('MRI KNEE', **bounds)['negotiated_rate'].tolist()
+    assert prices(min_price=19.99) == pytest.approx([19.99, 395.5, 410.0])
+    assert prices(max_price=19.99) == pytest.approx([19.99])
+    assert prices(min_price=395.5, max_price=410.0) == [395.5, 410.0]
+    assert prices(min_price=395.51, max_price=409.99) == []
+    assert prices(min_price=500, max_price=100) == []
+    assert prices(min_price=1000) == []
+    assert prices(max_price=0) == []
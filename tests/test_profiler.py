@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+import profiler
+from profiler import RequestProfiler, SamplingProfiler, write_folded
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    """Profiles handed to the slow request hooks, instead of logging them"""
+    profiles = []
+    monkeypatch.setattr(profiler, 'slow_request_hooks', [profiles.append])
+    return profiles
+
+
+def busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sample_rate_zero_never_profiles(monkeypatch, profiles):
+    monkeypatch.setattr(profiler.random, 'random', lambda: 0.0)
+    request_profiler = RequestProfiler(sample_rate=0, slow_seconds=0)
+
+    sampler = request_profiler.start()
+    assert sampler is None
+    request_profiler.finish(sampler, 'GET /api/search_results', 5.0)
+    assert profiles == []
+
+
+def test_sample_rate_one_profiles_every_request(profiles):
+    request_profiler = RequestProfiler(sample_rate=1, slow_seconds=0.01, interval=0.001)
+
+    sampler = request_profiler.start()
+    assert isinstance(sampler, SamplingProfiler)
+    busy(0.05)
+    request_profiler.finish(sampler, 'GET /api/search_results', 0.05)
+
+    assert [profile['request'] for profile in profiles] == ['GET /api/search_results']
+    # The samples are this thread's stacks, innermost frame last
+    stack = profiles[0]['samples'].most_common(1)[0][0]
+    assert 'test_profiler.py:busy:' in stack.split(';')[-1]
+
+
+def test_sampled_requests_under_the_threshold_are_not_reported(profiles):
+    request_profiler = RequestProfiler(sample_rate=1, slow_seconds=1, interval=0.001)
+
+    sampler = request_profiler.start()
+    busy(0.02)
+    request_profiler.finish(sampler, 'GET /api/procedures', 0.02)
+
+    assert profiles == []
+    assert not sampler._thread.is_alive()
+
+
+def test_settings_default_to_the_environment(monkeypatch):
+    monkeypatch.setenv('PROFILE_SAMPLE_RATE', '0.25')
+    monkeypatch.setenv('SLOW_REQUEST_MS', '250')
+    monkeypatch.setenv('PROFILE_INTERVAL_MS', '2')
+    request_profiler = RequestProfiler()
+
+    assert (request_profiler.sample_rate, request_profiler.slow_seconds, request_profiler.interval) == (0.25, 0.25, 0.002)
+
+
+def test_slow_profiles_are_written_in_folded_format(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROFILE_DIR', str(tmp_path))
+    write_folded({'request': 'GET /api/search_results?plan=Aetna_PPO', 'seconds': 1.5,
+                  'samples': profiler.Counter({'app.py:a:1;app.py:b:2': 3, 'app.py:a:1': 1})})
+
+    [path] = tmp_path.iterdir()
+    assert path.name.endswith('-GET_api_search_results_plan_Aetna_PPO.folded')
+    assert path.read_text() == 'app.py:a:1;app.py:b:2 3\napp.py:a:1 1\n'
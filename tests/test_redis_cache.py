@@ -0,0 +1,111 @@
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('msgpack')
+
+from cache import MISSING, CircuitBreaker, RedisCache
+
+
+class FailingRedis:
+    """A client whose every call fails, like an unreachable server"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        raise ConnectionError("connection refused")
+
+    def set(self, key, value, ex=None):
+        self.calls += 1
+        raise ConnectionError("connection refused")
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+
+def test_round_trip(client):
+    redis_cache = RedisCache(client)
+    value = {'results': [{'npi': 1234567890, 'rate': 12.5, 'name': 'Clinic'}], 'total': 1}
+    redis_cache.set('search:a', value)
+    assert redis_cache.get('search:a') == value
+    assert redis_cache.get('search:b') is MISSING
+    stats = redis_cache.stats()
+    assert (stats['sets'], stats['hits'], stats['misses']) == (1, 1, 1)
+
+
+def test_numpy_values_round_trip(client):
+    np = pytest.importorskip('numpy')
+    redis_cache = RedisCache(client)
+    redis_cache.set('k', {'count': np.int64(3), 'rates': np.array([1.5, 2.5])})
+    assert redis_cache.get('k') == {'count': 3, 'rates': [1.5, 2.5]}
+
+
+def test_keys_are_prefixed_with_namespace_and_version(client):
+    redis_cache = RedisCache(client, namespace='hc')
+    redis_cache.set('search:a', [1], version='v1')
+    assert client.exists('hc:v1:search:a')
+    assert redis_cache.get('search:a', version='v1') == [1]
+    # A new dataset version never sees the old entries
+    assert redis_cache.get('search:a', version='v2') is MISSING
+    assert redis_cache.stats()['version'] == 'v2'
+
+
+def test_negative_entries_use_negative_ttl(client):
+    redis_cache = RedisCache(client, ttl=3600, negative_ttl=60)
+    redis_cache.set('found', [1])
+    redis_cache.set('unknown', [], negative=True)
+    assert 3500 < client.ttl('healthcare::found') <= 3600
+    assert 0 < client.ttl('healthcare::unknown') <= 60
+
+
+def test_unencodable_value_is_not_stored(client):
+    redis_cache = RedisCache(client)
+    redis_cache.set('k', object())
+    assert redis_cache.get('k') is MISSING
+    assert redis_cache.stats()['errors'] == 1
+
+
+def test_breaker_opens_probes_and_closes(clock):
+    failing = FailingRedis()
+    redis_cache = RedisCache(failing, breaker=CircuitBreaker(threshold=3, reset_timeout=30))
+
+    for _ in range(3):
+        assert redis_cache.get('k') is MISSING
+    assert redis_cache.stats()['state'] == 'open'
+
+    # Open: calls are skipped without touching Redis
+    assert redis_cache.get('k') is MISSING
+    redis_cache.set('k', [1])
+    assert failing.calls == 3
+    assert redis_cache.stats()['skipped'] == 2
+
+    # After the timeout a single probe goes through; its failure re-opens the circuit
+    clock.now += 30
+    assert redis_cache.breaker.allow()
+    assert redis_cache.stats()['state'] == 'half-open'
+    assert not redis_cache.breaker.allow()
+    redis_cache.breaker.record_failure()
+    assert redis_cache.stats()['state'] == 'open'
+
+    # A successful probe closes it
+    clock.now += 30
+    redis_cache.client = fakeredis.FakeRedis()
+    redis_cache.set('k', [1])
+    assert redis_cache.stats()['state'] == 'closed'
+    assert redis_cache.get('k') == [1]
+
+
+def test_unencodable_value_does_not_strand_probe(clock):
+    redis_cache = RedisCache(FailingRedis(), breaker=CircuitBreaker(threshold=1, reset_timeout=30))
+    redis_cache.get('k')
+    assert redis_cache.stats()['state'] == 'open'
+
+    clock.now += 30
+    redis_cache.set('k', object())
+    assert redis_cache.stats()['state'] == 'open'
+    redis_cache.client = fakeredis.FakeRedis()
+    redis_cache.set('k', [1])
+    assert redis_cache.stats()['state'] == 'closed'
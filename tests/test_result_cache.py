@@ -0,0 +1,145 @@
+import threading
+import time
+
+from cache import MISSING, ResultCache, estimate_size, is_negative_result
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def run_concurrently(result_cache, key, compute, threads):
+    """Call get_or_compute from several threads; returns the value or exception each one got"""
+    outcomes = [None] * threads
+
+    def call(i):
+        try:
+            outcomes[i] = result_cache.get_or_compute(key, compute)
+        except Exception as e:
+            outcomes[i] = e
+
+    workers = [threading.Thread(target=call, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    return workers, outcomes
+
+
+def test_concurrent_misses_compute_once():
+    result_cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return [{'npi': 1}]
+
+    workers, outcomes = run_concurrently(result_cache, 'k', compute, threads=8)
+    # Every other thread is waiting on the leader before it finishes
+    wait_until(lambda: result_cache.stats()['coalesced'] == 7)
+    release.set()
+    for worker in workers:
+        worker.join()
+
+    assert len(calls) == 1
+    assert outcomes == [[{'npi': 1}]] * 8
+    assert result_cache.get('k') == [{'npi': 1}]
+
+
+def test_leader_exception_reaches_waiters_and_is_not_cached():
+    result_cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+        raise ValueError("plan file unreadable")
+
+    workers, outcomes = run_concurrently(result_cache, 'k', compute, threads=4)
+    wait_until(lambda: result_cache.stats()['coalesced'] == 3)
+    release.set()
+    for worker in workers:
+        worker.join()
+
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert result_cache.get('k', count=False) is MISSING
+    assert len(result_cache) == 0
+    # The next call computes again instead of replaying the failure
+    assert result_cache.get_or_compute('k', lambda: [1]) == [1]
+
+
+def test_falsy_values_are_hits():
+    result_cache = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return []
+
+    assert result_cache.get_or_compute('k', compute) == []
+    assert result_cache.get_or_compute('k', compute) == []
+    assert len(calls) == 1
+
+
+def test_oversize_value_is_rejected():
+    value = list(range(1000))
+    result_cache = ResultCache(max_bytes=estimate_size(value) - 1)
+    result_cache.set('small', [1])
+    result_cache.set('big', value)
+
+    assert result_cache.get('big') is MISSING
+    # Rejecting a value does not evict what is already cached
+    assert result_cache.get('small') == [1]
+    assert result_cache.stats()['rejections'] == 1
+
+
+def test_least_recently_used_is_evicted_first():
+    values = {key: [key] * 100 for key in 'abcd'}
+    size = estimate_size(values['a'])
+    result_cache = ResultCache(max_bytes=size * 3)
+    for key in 'abc':
+        result_cache.set(key, values[key])
+
+    # Reading 'a' makes 'b' the least recently used
+    assert result_cache.get('a') == values['a']
+    result_cache.set('d', values['d'])
+    assert result_cache.get('b', count=False) is MISSING
+
+    # Now 'c' is the oldest
+    result_cache.set('b', values['b'])
+    assert sorted(result_cache._entries) == ['a', 'b', 'd']
+    assert result_cache.stats()['evictions'] == 2
+    assert result_cache.stats()['bytes'] <= result_cache.max_bytes
+
+
+def test_negative_entries_expire_after_negative_ttl(clock):
+    result_cache = ResultCache(ttl=3600, negative_ttl=60)
+    calls = []
+
+    def compute(value):
+        def run():
+            calls.append(value)
+            return value
+        return run
+
+    result_cache.get_or_compute('unknown', compute([]), negative=is_negative_result)
+    result_cache.get_or_compute('found', compute([1]), negative=is_negative_result)
+
+    clock.now += 59
+    result_cache.get_or_compute('unknown', compute([]), negative=is_negative_result)
+    assert calls == [[], [1]]
+    assert result_cache.stats()['negative_hits'] == 1
+
+    clock.now += 2
+    result_cache.get_or_compute('unknown', compute([]), negative=is_negative_result)
+    result_cache.get_or_compute('found', compute([1]), negative=is_negative_result)
+    assert calls == [[], [1], []]
+    assert result_cache.stats()['expirations'] == 1
+
+    clock.now += 3600
+    assert result_cache.get('found') is MISSING
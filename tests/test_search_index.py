@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from dimensions import LEGAL_NAME_COLUMN, OTHER_NAME_COLUMN, POSTAL_CODE_COLUMN, ProcedureDimension, ProviderDimension
+from plan_index import PlanIndex
+from search_index import Postings
+
+
+def plan_frame(providers):
+    """Plan rows for (npi, legal name, other name) providers"""
+    return pd.DataFrame({
+        'npi': [npi for npi, _, _ in providers],
+        LEGAL_NAME_COLUMN: [legal for _, legal, _ in providers],
+        OTHER_NAME_COLUMN: [other for _, _, other in providers],
+        POSTAL_CODE_COLUMN: ['78701'] * len(providers),
+    })
+
+
+def test_merged_postings_match_a_dict_of_sets():
+    batches = [
+        [('knee', 0), ('skin', 0), ('knee', 1), ('vein', 2)],
+        [('heart', 3), ('knee', 4), ('skin', 3), ('aorta', 4), ('vein', 5)],
+    ]
+    postings, expected = Postings(), {}
+    for batch in batches:
+        previous = postings
+        postings = postings.merged([key for key, _ in batch], [entry_id for _, entry_id in batch])
+        for key, entry_id in batch:
+            expected.setdefault(key, set()).add(entry_id)
+        # The previous postings are a snapshot: merging copies them
+        assert previous is not postings
+
+    assert [key.decode() for key in postings.keys] == sorted(expected)
+    for key, ids in expected.items():
+        assert postings.get(key).dtype == np.int32
+        assert postings.get(key).tolist() == sorted(ids)
+    assert postings.get('missing').tolist() == []
+    assert postings.union(*postings.prefix_range('k')).tolist() == [0, 1, 4]
+    assert len(previous.keys) == 3 and previous.get('knee').tolist() == [0, 1]
+
+
+def test_provider_names_match_after_a_second_plan_load():
+    providers = ProviderDimension()
+    providers.intern(plan_frame([(1111111111, 'ST DAVIDS MEDICAL CENTER', None)]))
+    first_index = providers.search_index
+
+    # The second plan repeats one provider and adds two
+    second = providers.intern(plan_frame([
+        (1111111111, 'ST DAVIDS MEDICAL CENTER', None),
+        (2222222222, 'AUSTIN REGIONAL CLINIC PA', 'ARC FAR WEST'),
+        (None, 'LAKESIDE SURGERY CENTER LLC', 'LAKESIDE MEDICAL'),
+    ]))
+
+    assert second.tolist() == [0, 1, 2]
+    assert providers.search_index.match('medical').tolist() == [0, 2]
+    assert providers.search_index.match('arc far').tolist() == [1]
+    assert providers.search_index.match('regional clin').tolist() == [1]
+    # Readers holding the earlier index keep a consistent view of the first plan's providers
+    assert len(first_index) == 1 and first_index.match('medical').tolist() == [0]
+
+    results = providers.search('lakeside')
+    assert results == [{'npi': None, 'legal_name': 'LAKESIDE SURGERY CENTER LLC', 'other_name': 'LAKESIDE MEDICAL'}]
+    assert [result['npi'] for result in providers.search('center', provider_ids=np.array([0, 1]))] == [1111111111]
+
+
+def test_plans_share_one_procedure_index_and_see_only_their_procedures():
+    providers, procedures = ProviderDimension(), ProcedureDimension()
+
+    def plan(pairs):
+        df = plan_frame([(1111111111, 'ST DAVIDS MEDICAL CENTER', None)] * len(pairs))
+        return PlanIndex(df.assign(procedure_name=[name for name, _ in pairs],
+                                   billing_code=[code for _, code in pairs],
+                                   negotiated_rate=100.0), providers, procedures)
+
+    knee = plan([('MRI KNEE', '73721'), ('XRAY KNEE', '73560')])
+    heart = plan([('MRI HEART', '75557'), ('MRI KNEE', '73721')])
+
+    assert len(procedures.search_index) == 3
+    assert knee.search_procedures('mri') == [{'procedure_name': 'MRI KNEE', 'billing_code': '73721'}]
+    assert [entry['procedure_name'] for entry in heart.search_procedures('mri')] == ['MRI KNEE', 'MRI HEART']
+    assert heart.search_procedures('7555') == [{'procedure_name': 'MRI HEART', 'billing_code': '75557'}]
+    assert heart.search_procedures('7356') == []
+    assert knee.search_procedures('73560') == [{'procedure_name': 'XRAY KNEE', 'billing_code': '73560'}]
+    assert knee.search_procedures('heart') == []
+
+
+def test_restricted_ranking_matches_the_full_ranking_filtered():
+    names = ['MRI KNEE', 'MRI KNEE', 'KNEE ARTHROSCOPY', 'XRAY KNEE 2 VIEWS', 'KNEE INJECTION', 'MRI HEART',
+             'ARTHROSCOPY OF KNEE', 'KNEE', 'KNE REPAIR']
+    codes = ['73722', '73721', '29881', '73560', '20610', '75557', '29880', '27447', '27448']
+    index = ProcedureDimension().search_index.extend(names, codes)
+    plan_ids = np.array([0, 2, 4, 6, 7, 8])
+
+    for term in ['knee', 'kne', 'knee arth', 'arthroscopy', 'knea', '7372', '2', 'mri']:
+        full = index.rank(term, limit=0)
+        assert index.rank(term, limit=0, procedure_ids=plan_ids) == [i for i in full if i in plan_ids]
+        assert index.rank(term, limit=2, procedure_ids=plan_ids) == [i for i in full if i in plan_ids][:2]
+        assert index.rank(term, limit=3) == full[:3]
+
+    # Names starting with the term first, shorter first; equal names by code
+    assert index.rank('knee', limit=0)[:5] == [7, 4, 2, 1, 0]
+    assert index.rank('7372', limit=0) == [1, 0]
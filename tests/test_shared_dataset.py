@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from dataset import Dataset
+from shared_dataset import publish_dataset
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter, as a forked worker would attach
+ATTACH = '''
+import json, mmap, sys
+from shared_dataset import attach_dataset
+dataset = attach_dataset(sys.argv[1], None)
+
+def is_mapped(array):
+    # Backed by a file mapping rather than this process's heap
+    while array is not None and not isinstance(array, mmap.mmap):
+        array = getattr(array, 'base', None)
+    return array is not None
+
+def mapped(arrays):
+    return {name: not array.flags.writeable and is_mapped(array) for name, array in arrays.items()}
+
+print(json.dumps({
+    'version': dataset.version,
+    'writeable': {
+        filename: {column: plan_index.facts[column].to_numpy().flags.writeable for column in plan_index.facts}
+        for filename, plan_index in dataset.loaded_plans()
+    },
+    'mapped': {
+        **{filename: mapped(plan_index.arrays()) for filename, plan_index in dataset.loaded_plans()},
+        'providers': mapped(dataset.providers.arrays()),
+        'procedures': mapped(dataset.procedures.arrays()),
+        'all_procedures': mapped(dataset.get_all_procedures_search().arrays()),
+        'stats': mapped(dataset.stats_index.arrays()),
+    },
+    'results': {term: {
+        'all': dataset.get_all_procedures_search().search(term),
+        'providers': dataset.providers.search(term),
+        'procedures': dataset.procedures.search(term),
+        'stats': dataset.stats_index.lookup(term),
+        'rates': {filename: None if rows is None else rows['negotiated_rate'].tolist()
+                  for filename, plan_index in dataset.loaded_plans() for rows in [plan_index.lookup(term)]},
+    } for term in sys.argv[2:]},
+}))
+'''
+
+TERMS = ['knee', 'MRI KNEE', 'XRAY KNEE', '73721', '73560', 'clinic', '7372', 'missing']
+
+
+def results(dataset, terms):
+    # The same as ATTACH reports, computed in this process
+    return json.loads(json.dumps({term: {
+        'all': dataset.get_all_procedures_search().search(term),
+        'providers': dataset.providers.search(term),
+        'procedures': dataset.procedures.search(term),
+        'stats': dataset.stats_index.lookup(term),
+        'rates': {filename: None if rows is None else rows['negotiated_rate'].tolist()
+                  for filename, plan_index in dataset.loaded_plans() for rows in [plan_index.lookup(term)]},
+    } for term in terms}))
+
+
+def test_worker_attaches_fact_tables_and_indexes_as_read_only_views(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'Austin_Aetna_PPO_data.csv').write_text(
+        'procedure_name,billing_code,negotiated_rate,npi,Provider Organization Name (Legal Business Name)\n'
+        'MRI KNEE,73721,410.0,1111111111,NORTH AUSTIN CLINIC\nMRI KNEE,73721,395.5,2222222222,LAKESIDE SURGERY\n'
+        'MRI KNEE,73722,612.0,2222222222,LAKESIDE SURGERY\nXRAY KNEE,73560,80.0,1111111111,NORTH AUSTIN CLINIC\n'
+    )
+    (data_dir / 'Austin_Cigna_HMO_data.csv').write_text(
+        'procedure_name,billing_code,negotiated_rate,npi,Provider Organization Name (Legal Business Name)\n'
+        'XRAY KNEE,73560,99.0,3333333333,HILL COUNTRY CLINIC\n'
+    )
+    # A plan with a summary only is still in the stats and the all-plans autocomplete
+    (data_dir / 'summary_Austin_UHC_PPO.csv').write_text(
+        'procedure_name,billing_code,count,min,max,mean\nMRI KNEE,73721,4,300.0,500.0,410.0\n'
+        'CT KNEE,73700,2,200.0,250.0,225.0\n'
+    )
+    sources = {path.name: str(path) for path in data_dir.iterdir()}
+    dataset = Dataset(sources, None).load()
+    version = publish_dataset(dataset, str(tmp_path / 'shm'))
+
+    output = subprocess.run([sys.executable, '-c', ATTACH, str(tmp_path / 'shm')] + TERMS, cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    attached = json.loads(output)
+
+    assert attached['version'] == version
+    plans = ['Austin_Aetna_PPO_data.csv', 'Austin_Cigna_HMO_data.csv']
+    assert sorted(attached['writeable']) == plans
+    for columns in attached['writeable'].values():
+        assert columns == {'procedure_id': False, 'provider_id': False, 'negotiated_rate': False}
+    # Nothing is re-indexed in the worker: every index array is a view onto the shared files
+    assert sorted(attached['mapped']) == sorted(plans + ['providers', 'procedures', 'all_procedures', 'stats'])
+    for name, arrays in attached['mapped'].items():
+        assert arrays and all(arrays.values()), name
+
+    assert attached['results'] == results(dataset, TERMS)
+    assert attached['results']['73721']['rates']['Austin_Aetna_PPO_data.csv'] == [395.5, 410.0]
+    assert [entry['plans'] for entry in attached['results']['knee']['all']] == [
+        ['UHC_PPO'], ['Aetna_PPO', 'UHC_PPO'], ['Aetna_PPO'], ['Aetna_PPO', 'Cigna_HMO'],
+    ]
@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from data_processor import DataProcessor
+from ingest import _summarize
+from stats_index import StatsIndex
+
+# Rates are exact in float32, so plan facts and the raw frame agree to the cent
+RAW = pd.DataFrame([
+    ('Aetna_PPO', 'MRI KNEE', '73721', 410.0, 1111111111, 'ST DAVIDS MEDICAL CENTER'),
+    ('Aetna_PPO', 'MRI KNEE', '73721', 395.5, 2222222222, 'AUSTIN REGIONAL CLINIC PA'),
+    ('Aetna_PPO', 'MRI KNEE', '73721', 612.25, 3333333333, 'LAKESIDE SURGERY CENTER'),
+    ('Aetna_PPO', 'MRI KNEE', '73721', 280.75, 4444444444, 'NORTH AUSTIN CLINIC'),
+    ('Aetna_PPO', 'MRI KNEE', '73721', 1200.0, 5555555555, 'HILL COUNTRY CLINIC'),
+    ('Aetna_PPO', 'XRAY KNEE', '73560', 80.0, 1111111111, 'ST DAVIDS MEDICAL CENTER'),
+    ('Aetna_PPO', 'XRAY KNEE', '73560', 64.5, 2222222222, 'AUSTIN REGIONAL CLINIC PA'),
+    ('Cigna_HMO', 'MRI KNEE', '73721', 455.0, 1111111111, 'ST DAVIDS MEDICAL CENTER'),
+    ('Cigna_HMO', 'MRI KNEE', '73721', 330.25, 4444444444, 'NORTH AUSTIN CLINIC'),
+    ('Cigna_HMO', 'MRI KNEE', '73721', 505.5, 5555555555, 'HILL COUNTRY CLINIC'),
+    ('Cigna_HMO', 'XRAY KNEE', '73560', 99.0, 3333333333, 'LAKESIDE SURGERY CENTER'),
+], columns=['plan', 'procedure_name', 'billing_code', 'negotiated_rate', 'npi',
+            'Provider Organization Name (Legal Business Name)'])
+
+
+def expected_stats(rates: pd.core.groupby.SeriesGroupBy) -> pd.DataFrame:
+    """The summary statistics per group, computed with pandas (unrounded)"""
+    stats = rates.describe().rename(columns={'25%': 'Q1', '50%': 'median', '75%': 'Q3'})
+    stats['range'] = stats['max'] - stats['min']
+    stats['IQR'] = stats['Q3'] - stats['Q1']
+    stats['10th_percentile'] = rates.quantile(0.1)
+    stats['90th_percentile'] = rates.quantile(0.9)
+    return stats
+
+
+def assert_matches(result: dict, expected: pd.Series):
+    assert result['count'] == int(expected['count'])
+    for column, value in expected.drop('count').items():
+        # Results are rounded to the cent; a single rate has no sample standard deviation
+        assert result[column] == (None if pd.isna(value) else pytest.approx(value, abs=0.01)), column
+
+
+def test_stats_index_matches_a_pandas_groupby():
+    summaries = [(plan, _summarize(df.drop(columns='plan'))) for plan, df in RAW.groupby('plan')]
+    stats_index = StatsIndex(summaries)
+    expected = expected_stats(RAW.groupby(['procedure_name', 'plan'])['negotiated_rate'])
+
+    for procedure in ['MRI KNEE', 'XRAY KNEE']:
+        result = stats_index.lookup(procedure)
+        assert sorted(result) == ['Aetna_PPO', 'Cigna_HMO']
+        for plan, stats in result.items():
+            assert_matches(stats, expected.loc[(procedure, plan)])
+    # Billing codes fall back to the same rows
+    assert stats_index.lookup('73560.0') == stats_index.lookup('XRAY KNEE')
+
+
+@pytest.fixture
+def processor(tmp_path):
+    for plan, df in RAW.groupby('plan'):
+        df.drop(columns='plan').to_csv(tmp_path / f"Austin_{plan}_data.csv", index=False)
+        _summarize(df).to_csv(tmp_path / f"summary_Austin_{plan}.csv", index=False)
+    return DataProcessor(str(tmp_path), lazy_load=False, reload_interval=0)
+
+
+@pytest.mark.parametrize('filters, rows', [
+    ({}, lambda df: df),
+    ({'min_price': 300, 'max_price': 612.25}, lambda df: df[df['negotiated_rate'].between(300, 612.25)]),
+    ({'max_price': 395.5}, lambda df: df[df['negotiated_rate'] <= 395.5]),
+    ({'provider': 'clinic'}, lambda df: df[df['Provider Organization Name (Legal Business Name)'].str.contains('CLINIC')]),
+    ({'provider': 'clinic', 'min_price': 400}, lambda df: df[
+        df['Provider Organization Name (Legal Business Name)'].str.contains('CLINIC') & (df['negotiated_rate'] >= 400)
+    ]),
+])
+def test_filtered_stats_match_a_pandas_groupby(processor, filters, rows):
+    result = processor._compute_stats_data(processor.dataset, 'MRI KNEE', None, filters.get('provider'),
+                                           filters.get('min_price'), filters.get('max_price'), None)
+    expected = expected_stats(rows(RAW[RAW['procedure_name'] == 'MRI KNEE']).groupby('plan')['negotiated_rate'])
+
+    assert sorted(result) == sorted(expected.index)
+    for plan, stats in result.items():
+        assert (stats['procedure_name'], stats['billing_code']) == ('MRI KNEE', '73721')
+        assert_matches(stats, expected.loc[plan])
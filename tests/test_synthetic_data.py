@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from dataset import Dataset, parse_insurance_info
+from ingest import discover_sources, read_csv_typed
+from stats_index import SUMMARY_STAT_COLUMNS, compute_stats
+from synthetic_data import DATA_COLUMNS, generate, zipf_weights
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROCEDURES = 50
+
+
+@pytest.fixture(scope='module')
+def generated(tmp_path_factory):
+    out_dir = tmp_path_factory.mktemp('synthetic')
+    written = generate(str(out_dir), rows=4000, plans=2, procedures=PROCEDURES, providers=100, seed=7)
+    return out_dir, written
+
+
+def test_generator_writes_plans_the_dataset_loads(generated):
+    out_dir, written = generated
+    assert sorted(os.listdir(out_dir)) == [
+        'Austin_Synthetic1_PPO_data.csv', 'Austin_Synthetic2_PPO_data.csv',
+        'summary_Austin_Synthetic1_PPO.csv', 'summary_Austin_Synthetic2_PPO.csv',
+    ]
+    for paths in written:
+        assert not parse_insurance_info(os.path.basename(paths['data']))['is_summary']
+        assert parse_insurance_info(os.path.basename(paths['summary']))['is_summary']
+        assert list(read_csv_typed(paths['data']).columns) == DATA_COLUMNS
+        assert list(read_csv_typed(paths['summary']).columns) == ['billing_code', 'procedure_name'] + SUMMARY_STAT_COLUMNS
+
+    dataset = Dataset(discover_sources(str(out_dir)), None).load()
+    assert [len(plan_index) for _, plan_index in dataset.loaded_plans()] == [2000, 2000]
+    assert len(dataset.stats_index.plans) == 2
+
+
+def test_summaries_match_compute_stats_on_the_data(generated):
+    _, written = generated
+    for paths in written:
+        data = read_csv_typed(paths['data'])
+        summary = read_csv_typed(paths['summary']).set_index(['procedure_name', 'billing_code'])
+        groups = data.groupby(['procedure_name', 'billing_code'])['negotiated_rate']
+        assert len(summary) == groups.ngroups
+        for key, rates in groups:
+            expected = compute_stats(rates.to_numpy())
+            assert summary.loc[key, SUMMARY_STAT_COLUMNS].tolist() == pytest.approx(
+                [expected[column] for column in SUMMARY_STAT_COLUMNS], nan_ok=True)
+
+
+def test_procedure_popularity_follows_the_zipf_law(generated):
+    _, written = generated
+    expected_top = zipf_weights(PROCEDURES, 1.1)[:PROCEDURES // 10].sum()
+    for paths in written:
+        counts = np.sort(read_csv_typed(paths['data'])['procedure_name'].value_counts().to_numpy())[::-1]
+        # The top tenth of procedures hold over half the rows, as the weights say
+        share = counts[:PROCEDURES // 10].sum() / counts.sum()
+        assert share == pytest.approx(expected_top, abs=0.05)
+        assert counts[0] > 10 * np.median(counts)
+
+
+def test_one_request_benchmark_reports_every_section(tmp_path):
+    output = tmp_path / 'report.json'
+    subprocess.run([sys.executable, 'benchmark.py', '--rows', '2000', '--plans', '2', '--procedures', '30',
+                    '--providers', '50', '--requests', '1', '--output', str(output)],
+                   cwd=REPO_ROOT, check=True, capture_output=True)
+    report = json.loads(output.read_text())
+
+    assert set(report) == {'meta', 'cold_start', 'results', 'peak_rss_mb'}
+    assert report['meta']['params']['rows'] == 2000 and report['meta']['data_bytes'] > 0
+    assert report['cold_start']['plans'] == 2 and report['cold_start']['rows'] == 2000
+    assert {(result['endpoint'], result['scenario']) for result in report['results']} == {
+        (endpoint, scenario)
+        for endpoint in ['search_procedures', 'get_search_results', 'get_stats_data', 'export_search_results',
+                         'batch_quotes']
+        for scenario in ['cache_miss', 'cache_hit']
+    }
+    for result in report['results']:
+        assert result['requests'] == 1 and result['errors'] == 0
+        assert {'p50_ms', 'p90_ms', 'p99_ms', 'mean_ms', 'max_ms', 'throughput_rps'} <= set(result)